@@ -11,29 +11,57 @@ esc: get help
 {insert}: insert file at current position
 {jump}: go to line & column (yalla, let's bounce)
 {name_complete}: activate name completion, if Jedi is installed
+{word_complete}: complete the word before the cursor from the words in the file,
+    pressing it again cycles through the less common ones
 
-{cut}: cuts the current line to the clipboard
+{cut}: cuts the current line, or the marked lines, to the clipboard
 {paste}: pastes the clipboard to the current line
 {clear_clipboard}: clears the clipboard (these spell K-U-T by default)
 
+{mark}: set or clear the mark, the lines from it to the cursor are marked
+{copy}: copies the marked lines to the clipboard
+{indent}: indents the marked lines, or the current line
+{dedent}: dedents the marked lines, or the current line
+{comment}: toggles comments on the marked lines, or the current line
+
 {find}: set regular expression and jump to first match
 {find_next}: jump to next match of current regular expression
 {replace}: set substitution for regular expression and replace first match
 {replace_next}: replace next match of current regular expression
+{find_project}: search files under the current directory, then jump to a hit
+{columns}: toggle aligned columns for tab or comma separated data
+{match}: jump to the bracket matching the one under the cursor
+{fold}: fold or unfold the block that starts on the current line
+{fold_all}: fold every top level block, or unfold everything
 """
 import os
 import re
 import io
 import sys
+import csv
+import codecs
 import json
 import time
+import mmap
+import zlib
+import queue
+import hashlib
+import shutil
+import bisect
+import difflib
+import importlib
+import threading
+import subprocess
+import multiprocessing
 from glob import glob
 from itertools import zip_longest
+from array import array
 from collections import deque
 from collections.abc import Mapping, Sequence
 from argparse import ArgumentParser, RawDescriptionHelpFormatter, _StoreTrueAction
 import urwid
 import pygments.util
+import pygments.lexers
 import pygments_cache
 from pygments.lexers.special import TextLexer
 from pygments.lexers.python import PythonLexer, Python3Lexer
@@ -48,8 +76,32 @@ RE_NOT_WORD = re.compile(r'\W+')
 RE_NOT_SPACE = re.compile(r'\S')
 RE_TWO_DIGITS = re.compile("(\d+)(\D+)?(\d+)?")
 RE_SPACES = re.compile(r'( +)')
+RE_JUMP = re.compile(r'^(.*?:\d+:\d+):')
+RE_BRACKETS = re.compile(r'[()\[\]{}]')
+RE_IDENT = re.compile(r'[^\W\d]\w+')  # identifiers of two or more characters
+RE_WORD_END = re.compile(r'\w+$')
+RE_SPECIAL = re.compile(r'[.^$*+?{}\[\]\\|()]')  # queries without these are literal
+RE_GLOB = re.compile(r'[*?\[]')  # filename patterns, rather than names
+BRACKETS = {'(': ')', '[': ']', '{': '}'}
 
 RC_PATH = os.path.expanduser('~/.config/xo/rc.json')
+CACHE_RC_PATH = os.path.expanduser('~/.cache/xo/rc.json')  # from older versions
+STDIN_NAME = '-'  # reads the buffer from a pipe on standard input
+# commands and keys that are turned off when viewing
+EDIT_COMMANDS = ('save', 'cut', 'paste', 'clear_clipboard', 'insert', 'replace',
+                 'replace_next', 'name_complete', 'columns', 'match', 'mark', 'copy',
+                 'indent', 'dedent', 'comment', 'fold', 'fold_all', 'word_complete')
+EDIT_KEYS = ('enter', 'delete', 'backspace', 'ctrl left', 'meta left', 'ctrl right',
+             'meta right', 'paste')
+# keys that stand for characters inside of a bracketed paste
+PASTE_KEYS = {'enter': '\n', 'ctrl j': '\n', 'ctrl m': '\n', 'tab': '\t'}
+# gutter marks of lines added, changed, or with lines removed above them
+GUTTER_ATTRS = {' ': None, '+': 'diff add', '~': 'diff change', '-': 'diff remove'}
+# sent by terminals that are asked to report focus, which urwid does not know
+FOCUS_KEYS = (('[I', 'focus in'), ('[O', 'focus out'))
+CACHE_DIR = os.path.expanduser('~/.cache/xo')
+LEXER_CACHE_PATH = os.path.join(CACHE_DIR, 'lexers.json')
+SESSIONS_PATH = os.path.join(CACHE_DIR, 'sessions.json')
 DEFAULT_RC = {
     'queries': [],
     'replacements': [],
@@ -152,9 +204,62 @@ DEFAULT_RC = {
         "replace": "ctrl r",
         "replace_next": "meta r",
         "name_complete": "ctrl n",
+        "word_complete": "meta n",
+        "find_project": "meta g",
+        "columns": "meta c",
+        "match": "meta m",
+        "mark": "meta a",
+        "copy": "meta 6",
+        "indent": "meta i",
+        "dedent": "meta u",
+        "comment": "meta /",
+        "fold": "meta f",
+        "fold_all": "meta F",
+        },
+    'comments': {
+        # name: line comment prefix
+        'default': '#',
+        'c': '//',
+        'h': '//',
+        'cc': '//',
+        'c++': '//',
+        'h++': '//',
+        'cpp': '//',
+        'hpp': '//',
+        'cxx': '//',
+        'hxx': '//',
+        'js': '//',
+        'java': '//',
+        'go': '//',
+        'rs': '//',
+        'sql': '--',
+        'hs': '--',
+        'lua': '--',
+        'tex': '%',
         },
     'multiline_window': 750,  # this is good size to balance response vs long comments
     'number_of_windows': 1,   # maximum nuber of windows to pane.
+    'follow_interval': 0.5,   # seconds between polls of a followed file.
+    'long_line': 4096,        # lines longer than this are only lexed where visible,
+    'long_line_chunk': 1024,  # in chunks of this many columns.
+    'match_scan_lines': 1000,  # lines searched for a bracket to highlight
+    'max_sessions': 256,  # files whose cursor, lexer, and style are remembered
+    'journal': True,  # keeps a crash recovery journal of unsaved edits
+    'journal_interval': 1.0,  # seconds between journal writes and syncs
+    'columnar': ['tsv', 'csv'],  # extensions that open with aligned columns
+    'column_max_width': 40,
+    'large_file': None,  # true or false forces large file mode, null picks by size
+    'large_file_size': 64 * 2**20,  # bytes
+    'project_search_processes': None,  # None means one per cpu
+    'project_search_max_hits': 10000,
+    'bracketed_paste': True,  # pastes arrive as one block, not as keystrokes
+    'parallel_highlight': False,  # lex whole files in worker processes
+    'parallel_highlight_processes': None,  # None means one per cpu
+    'parallel_highlight_delay': 1.0,  # seconds without edits before relexing
+    'search_timeout': 10.0,  # seconds a regular expression search may take
+    'check_on_focus': True,  # checks for changes on disk when the terminal is focused
+    'diff_gutter': True,  # marks the lines that differ from the last git commit
+    'diff_gutter_interval': 0.25,  # seconds between diffs of the edited lines
     }
 DEFAULT_RC['rgb_to_short'] = {v: k for k, v in DEFAULT_RC['short_to_rgb'].items()}
 
@@ -192,6 +297,85 @@ def json_rc_load(fname):
             rc = {}
     return rc
 
+_RC_CACHE = None  # (key, rc)
+_PALETTE_CACHE = {}
+
+def rc_key():
+    """Identifies the state of the rc files, so that what is built from them
+    can be rebuilt when they change.
+    """
+    key = []
+    for fname in (CACHE_RC_PATH, RC_PATH):
+        try:
+            st = os.stat(fname)
+        except OSError:
+            key.append(None)
+        else:
+            key.append((st.st_mtime_ns, st.st_size))
+    return tuple(key)
+
+def load_rc():
+    """Returns the merged rc. It is kept for the life of the process, until one
+    of the rc files changes, and should not be modified.
+    """
+    global _RC_CACHE
+    key = rc_key()
+    if _RC_CACHE is None or _RC_CACHE[0] != key:
+        cacherc = json_rc_load(CACHE_RC_PATH)
+        configrc = json_rc_load(RC_PATH)
+        rc = merge_rcs(DEFAULT_RC, cacherc)
+        rc = merge_rcs(rc, configrc)
+        _RC_CACHE = (key, rc)
+        _PALETTE_CACHE.clear()  # they depend on the colors in the rc
+    return _RC_CACHE[1]
+
+def style_palette(style_class, mapping, base=()):
+    """Converts a pygments style to an urwid palette, which is cached."""
+    palette = _PALETTE_CACHE.get(style_class)
+    if palette is not None:
+        return palette
+    default = 'default'
+    palette = list(base)
+    for tok in style_class.styles.keys():
+        for t in tok.split()[::-1]:
+            st = style_class.styles[t]
+            if '#' in st:
+                break
+        if '#' not in st:
+            st = ''
+        st = st.split()
+        st.sort()   # '#' comes before '[A-Za-z0-9]'
+        if len(st) == 0:
+            c = default
+        elif st[0].startswith('bg:'):
+            c = default
+        elif len(st[0]) == 7:
+            c = 'h' + rgb_to_short(st[0][1:], mapping)[0]
+        elif len(st[0]) == 4:
+            c = 'h' + rgb_to_short(st[0][1]*2 + st[0][2]*2 + st[0][3]*2, mapping)[0]
+        else:
+            c = default
+        a = urwid.AttrSpec(c, default, colors=256)
+        row = (tok, default, default, default, a.foreground, default)
+        palette.append(row)
+    _PALETTE_CACHE[style_class] = palette
+    return palette
+
+def warm():
+    """Builds what opening a file needs ahead of time: the rc, the palette of
+    its style, and the lexers that files were opened with before. All of it is
+    kept in the process, so this is for long lived hosts, such as xonsh.
+    """
+    rc = load_rc()
+    style = pygments_cache.get_style_by_name(rc['style'])
+    style_palette(style, rc['rgb_to_short'], MainDisplay.base_palette)
+    paths = {tuple(p) for p in load_lexer_cache()['filenames'].values() if p}
+    for path in paths:
+        try:
+            pooled_lexer(*path)
+        except (ImportError, AttributeError):
+            pass  # pygments has changed since
+
 def rgb_to_short(rgb, mapping):
     """Find the closest xterm-256 approximation to the given RGB value."""
     # Thanks to Micah Elliott (http://MicahElliott.com) for colortrans.py
@@ -223,6 +407,556 @@ class NonEmptyFilter(Filter):
             if len(value) > 0:
                 yield ttype, value
 
+LEXER_FILTERS = ('nonempty', 'tokenmerge')
+_LEXER_POOL = {}
+_LEXER_CACHE = None
+
+def pooled_lexer(modname, clsname, filters=LEXER_FILTERS):
+    """Returns a configured lexer instance that is shared by the whole process."""
+    key = (modname, clsname, filters)
+    lexer = _LEXER_POOL.get(key)
+    if lexer is None:
+        lexer = getattr(importlib.import_module(modname), clsname)()
+        lexer = Python3Lexer() if isinstance(lexer, PythonLexer) else lexer
+        for f in filters:
+            lexer.add_filter(NonEmptyFilter() if f == 'nonempty' else f)
+        _LEXER_POOL[key] = lexer
+    return lexer
+
+def load_lexer_cache():
+    """Loads the lexer decisions from disk, these are dropped whenever the
+    version of pygments changes.
+    """
+    global _LEXER_CACHE
+    if _LEXER_CACHE is None:
+        cache = json_rc_load(LEXER_CACHE_PATH)
+        if cache.get('pygments') != pygments.__version__:
+            cache = {'pygments': pygments.__version__, 'filenames': {},
+                     'shebangs': {}}
+        _LEXER_CACHE = cache
+    return _LEXER_CACHE
+
+def ensure_cache_dir():
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+
+def dump_lexer_cache(max_entries=512):
+    """Writes the lexer decisions to disk, keeping the most recent ones. The
+    file is replaced as a whole, so other editors never read half of it.
+    """
+    cache = load_lexer_cache()
+    for table in (cache['filenames'], cache['shebangs']):
+        for k in list(table)[:max(len(table) - max_entries, 0)]:
+            del table[k]
+    ensure_cache_dir()
+    tmp = '{0}.{1}.tmp'.format(LEXER_CACHE_PATH, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp, LEXER_CACHE_PATH)
+
+_LEXER_NAMES = None
+
+def lexer_cache_key(fname):
+    """Returns what the lexer of a file is remembered by: the name itself for
+    files that pygments knows by name, such as Makefile, and otherwise the
+    extension, so that there is about one entry per language.
+    """
+    global _LEXER_NAMES
+    if _LEXER_NAMES is None:
+        _LEXER_NAMES = {f for lexer in pygments.lexers.LEXERS.values()
+                        for f in lexer[3] if not RE_GLOB.search(f)}
+    base = os.path.basename(fname)
+    ext = os.path.splitext(base)[1]
+    return base if not ext or base in _LEXER_NAMES else '*' + ext
+
+def _lexer_class_path(lexer):
+    cls = type(lexer)
+    return [cls.__module__, cls.__name__]
+
+COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma', '.zst': 'zstandard'}
+
+def compression_of(name):
+    """Returns the name of the module that (de)compresses the file, if any."""
+    return COMPRESSIONS.get(os.path.splitext(name)[1])
+
+def strip_compression(name):
+    """Returns the filename without its compression extension."""
+    return os.path.splitext(name)[0] if compression_of(name) else name
+
+def open_text(name, mode='r', compression=None):
+    """Opens a file as text, streaming it through a (de)compressor when the
+    filename, or the given compression, asks for one.
+    """
+    compression = compression or compression_of(name)
+    if compression is None:
+        return open(name, mode)
+    if compression == 'gzip' and mode == 'r':
+        return io.TextIOWrapper(io.BufferedReader(GzipCheckpoints(name)))
+    mod = importlib.import_module(compression)
+    return mod.open(name, mode + 't')
+
+class GzipCheckpoints(io.RawIOBase):
+    """Raw reader of gzip files that copies the decompressor every so often, so
+    that seeking only inflates from the nearest checkpoint, not the whole file.
+    """
+
+    chunk = 2**16
+
+    def __init__(self, name, interval=2**22):
+        self.f = open(name, 'rb')
+        self.interval = interval
+        # (offset, compressed offset, decompressor, unconsumed input)
+        self.checkpoints = [(0, 0, zlib.decompressobj(31), b'')]
+        self.offsets = [0]
+        self._restore(0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+    def _restore(self, i):
+        self.pos, cpos, d, self.pending = self.checkpoints[i]
+        self.f.seek(cpos)
+        self.d = d.copy()
+
+    def _inflate(self, n):
+        """Returns up to n more bytes, an empty string at the end of the file."""
+        while True:
+            if self.d.eof:
+                data = self.d.unused_data or self.f.read(self.chunk)
+                if not data.strip(b'\0'):
+                    return b''  # trailing garbage after the last member
+                self.d, self.pending = zlib.decompressobj(31), data
+            if not self.pending:
+                self.pending = self.f.read(self.chunk)
+                if not self.pending:
+                    return b''  # truncated
+            out = self.d.decompress(self.pending, n)
+            self.pending = self.d.unconsumed_tail
+            if out:
+                return out
+
+    def readinto(self, b):
+        out = self._inflate(len(b))
+        n = len(out)
+        b[:n] = out
+        self.pos += n
+        if self.pos >= self.offsets[-1] + self.interval:
+            self.checkpoints.append((self.pos, self.f.tell(), self.d.copy(),
+                                     self.pending))
+            self.offsets.append(self.pos)
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("can't seek from the end")
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        if offset < self.pos or self.offsets[i] > self.pos:
+            self._restore(i)
+        buf = bytearray(min(self.chunk, offset - self.pos) or 1)
+        while self.pos < offset:
+            view = memoryview(buf)[:offset - self.pos]
+            if self.readinto(view) == 0:
+                break
+        return self.pos
+
+def lexer_for_filename(fname, first_line=""):
+    """Returns a pooled lexer for a file. The filename is tried first, and then
+    the shebang line. Both decisions are remembered on disk.
+    """
+    fname = strip_compression(fname)
+    cache = load_lexer_cache()
+    filenames, shebangs = cache['filenames'], cache['shebangs']
+    key = lexer_cache_key(fname)
+    dirty = False
+    if key not in filenames:
+        try:
+            path = _lexer_class_path(pygments_cache.get_lexer_for_filename(fname))
+        except pygments.util.ClassNotFound:
+            path = None
+        filenames[key] = path
+        dirty = True
+    path = filenames[key]
+    shebang = first_line.strip()
+    if path is None and shebang.startswith('#!'):
+        if shebang not in shebangs:
+            shebangs[shebang] = _lexer_class_path(pygments.lexers.guess_lexer(shebang))
+            dirty = True
+        path = shebangs[shebang]
+    if dirty:
+        dump_lexer_cache()
+    path = path or _lexer_class_path(TextLexer())
+    return pooled_lexer(*path)
+
+class Literal(object):
+    """A query without special characters. It is found with str.find, and only
+    the hit itself goes through the regular expression engine.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.regex = re.compile(re.escape(pattern))
+
+    def search(self, s, pos=0):
+        i = s.find(self.pattern, pos)
+        return None if i < 0 else self.regex.match(s, i)
+
+    def sub(self, repl, s, count=0):
+        return self.regex.sub(repl, s, count=count)
+
+def compile_query(q):
+    """Returns a Literal for plain queries, and None for the others, which
+    are run by a RegexSearch.
+    """
+    return None if RE_SPECIAL.search(q) else Literal(q)
+
+class WordIndex(object):
+    """Counts the identifiers in the lines of a buffer and finds them by prefix
+    with a trie. Lines are marked dirty as they change and only those are
+    counted again, when the index is next used.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.trie = {}  # char -> node, '' marks the end of a counted word
+        self.words = {}  # line widget -> words counted for it
+        self.dirty = set()
+
+    def _add(self, word):
+        n = self.counts.get(word, 0)
+        self.counts[word] = n + 1
+        if n == 0:
+            node = self.trie
+            for c in word:
+                node = node.setdefault(c, {})
+            node[''] = True
+
+    def _remove(self, word):
+        n = self.counts[word] - 1
+        if n > 0:
+            self.counts[word] = n
+            return
+        del self.counts[word]
+        path = [self.trie]
+        for c in word:
+            path.append(path[-1][c])
+        del path[-1]['']
+        # drops the nodes that no other word goes through, from the end up
+        for i in range(len(word), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][word[i - 1]]
+
+    def forget(self, w):
+        """Drops the words of a line that was deleted."""
+        self.dirty.discard(w)
+        for word in self.words.pop(w, ()):
+            self._remove(word)
+
+    def sync(self):
+        """Counts the words of the lines that changed."""
+        for w in self.dirty:
+            for word in self.words.pop(w, ()):
+                self._remove(word)
+            words = RE_IDENT.findall(w.edit_text)
+            for word in words:
+                self._add(word)
+            self.words[w] = words
+        self.dirty.clear()
+
+    def complete(self, prefix):
+        """Returns the words that start with prefix, most common first."""
+        node = self.trie
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return []
+        found = []
+        counts = self.counts
+        stack = [(node, prefix)]
+        while stack:
+            node, word = stack.pop()
+            for c, child in node.items():
+                if c == '':
+                    if word != prefix:
+                        found.append(word)
+                else:
+                    stack.append((child, word + c))
+        found.sort(key=lambda word: (-counts[word], word))
+        return found
+
+class History(deque):
+    """A deque of unique strings that is backed by an append-only log on disk.
+    Appending writes a single line, and the log is compacted down to the kept
+    entries once it holds twice as many lines as that.
+    """
+
+    def __init__(self, fname, maxlen, initial=()):
+        super().__init__(maxlen=maxlen)
+        self.fname = fname
+        self.index = None  # sorted entries, for finding them by prefix
+        self.stamps = {}  # entry -> when it was last added
+        self.nadded = 0
+        entries = list(initial)
+        nlogged = 0
+        if os.path.isfile(fname):
+            with open(fname) as f:
+                for line in f:
+                    nlogged += 1
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        pass  # torn write
+        for entry in entries:
+            self._add(entry)
+        self.nlogged = nlogged
+        if nlogged > 2 * maxlen:
+            self.compact()
+
+    def _add(self, entry):
+        try:
+            self.remove(entry)
+        except ValueError:
+            pass
+        else:
+            self._unindex(entry)
+        if len(self) == self.maxlen:
+            self._unindex(self[0])  # about to fall off the left
+            del self.stamps[self[0]]
+        super().append(entry)
+        self.stamps[entry] = self.nadded
+        self.nadded += 1
+        if self.index is not None:
+            bisect.insort(self.index, entry)
+
+    def _unindex(self, entry):
+        if self.index is not None:
+            del self.index[bisect.bisect_left(self.index, entry)]
+
+    def prefixed(self, prefix):
+        """Returns the entries that start with prefix, most recent first. The
+        sorted index is built on first use, and the entries that start with
+        prefix are the run of it from where prefix would be inserted.
+        """
+        if self.index is None:
+            self.index = sorted(self)
+        index = self.index
+        found = []
+        for i in range(bisect.bisect_left(index, prefix), len(index)):
+            if not index[i].startswith(prefix):
+                break
+            found.append(index[i])
+        found.sort(key=self.stamps.get, reverse=True)
+        return found
+
+    def append(self, entry):
+        self._add(entry)
+        ensure_cache_dir()
+        with open(self.fname, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        self.nlogged += 1
+        if self.nlogged > 2 * self.maxlen:
+            self.compact()
+
+    def compact(self):
+        """Rewrites the log so that it only holds the kept entries."""
+        ensure_cache_dir()
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w') as f:
+            for entry in self:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp, self.fname)
+        self.nlogged = len(self)
+
+def load_session(fname):
+    """Returns what was remembered about a file when it was last closed, as
+    long as it has not changed since.
+    """
+    session = json_rc_load(SESSIONS_PATH).get(os.path.abspath(fname), {})
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return {}
+    if session.get('stat') != [st.st_size, st.st_mtime_ns]:
+        return {}
+    return session
+
+def dump_session(fname, max_sessions=256, **session):
+    """Remembers things about a file, such as the cursor position. Only the
+    most recently closed files are kept. Nothing is remembered about a file
+    that was deleted or renamed meanwhile. The file of sessions is replaced as
+    a whole, so other editors never read half of it.
+    """
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return
+    session['stat'] = [st.st_size, st.st_mtime_ns]
+    sessions = json_rc_load(SESSIONS_PATH)
+    key = os.path.abspath(fname)
+    sessions.pop(key, None)
+    sessions[key] = session
+    for k in list(sessions)[:max(len(sessions) - max_sessions, 0)]:
+        del sessions[k]
+    ensure_cache_dir()
+    tmp = '{0}.{1}.tmp'.format(SESSIONS_PATH, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(sessions, f)
+    os.replace(tmp, SESSIONS_PATH)
+
+def journal_path(fname):
+    """The location of the crash recovery journal for a file."""
+    h = hashlib.sha1(os.path.abspath(fname).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, 'journal', h + '.jsonl')
+
+class Journal(object):
+    """Crash recovery journal of the edits to a file. Records are JSON lines
+    written by a background thread, which syncs them to disk in batches. The
+    first line records the size and mtime of the file that the edits apply to.
+    """
+
+    def __init__(self, fname, stat, sync_interval=1.0):
+        self.path = path = journal_path(fname)
+        self.sync_interval = sync_interval
+        self.queue = queue.Queue()
+        dname = os.path.dirname(path)
+        if not os.path.isdir(dname):
+            os.makedirs(dname)
+        new = not os.path.isfile(path)
+        self.file = open(path, 'a')
+        if new:
+            self.record(['file', os.path.abspath(fname), stat.st_size,
+                         stat.st_mtime_ns])
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def load(fname, stat):
+        """Returns the edit records for a file, or None when there is no
+        journal that applies to this version of it.
+        """
+        path = journal_path(fname)
+        if not os.path.isfile(path):
+            return None
+        records = []
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break  # torn write at the end
+        if len(records) == 0 or records[0][2:] != [stat.st_size, stat.st_mtime_ns]:
+            os.remove(path)  # the file changed underneath the journal
+            return None
+        return records[1:]
+
+    def record(self, rec):
+        self.queue.put(rec)
+
+    def _run(self):
+        f = self.file
+        q = self.queue
+        synced = True
+        while True:
+            try:
+                rec = q.get(timeout=self.sync_interval)
+            except queue.Empty:
+                if not synced:
+                    os.fsync(f.fileno())
+                    synced = True
+                continue
+            if rec is None:
+                break
+            lines = [json.dumps(rec)]
+            while not q.empty():  # batch up everything that is waiting
+                rec = q.get()
+                if rec is None:
+                    q.put(None)
+                    break
+                lines.append(json.dumps(rec))
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+            synced = False
+        f.close()
+
+    def close(self, remove=False):
+        """Stops the writer thread, and removes the journal if asked to."""
+        self.queue.put(None)
+        self.thread.join()
+        if remove and os.path.isfile(self.path):
+            os.remove(self.path)
+
+class FileStamp(object):
+    """The size, modification time, and inode of a file as it was read, and
+    hashes of its chunks, which are computed in a background thread. Checking
+    the stat is cheap, and the file is only read again once the stat changes.
+    """
+
+    def __init__(self, name, chunk=2**20):
+        self.name = name
+        self.chunk = chunk
+        self.hashes = []
+        f = open(name, 'rb')
+        self.stat = os.fstat(f.fileno())
+        self.thread = threading.Thread(target=self._run, args=(f,), daemon=True)
+        self.thread.start()
+
+    def _run(self, f):
+        with f:
+            for block in iter(lambda: f.read(self.chunk), b''):
+                self.hashes.append(self._hash(block))
+
+    @staticmethod
+    def _hash(block):
+        return hashlib.blake2b(block, digest_size=16).digest()
+
+    @staticmethod
+    def _key(st):
+        return st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev
+
+    def changed(self):
+        """Returns None if the file is as it was read, or else the byte offset
+        of the first chunk that differs. A file that was only touched, or
+        rewritten with the same contents, takes on its new stat. While the
+        chunks are still being hashed, a changed stat gives offset 0 rather
+        than waiting for them.
+        """
+        try:
+            st = os.stat(self.name)
+        except OSError:
+            return None  # deleted, so writing it loses nothing
+        if self._key(st) == self._key(self.stat):
+            return None
+        if self.thread.is_alive():
+            return 0
+        offset = None
+        with open(self.name, 'rb') as f:
+            st = os.fstat(f.fileno())
+            for i, h in enumerate(self.hashes):
+                if self._hash(f.read(self.chunk)) != h:
+                    offset = i * self.chunk
+                    break
+            else:
+                if f.read(1):
+                    offset = len(self.hashes) * self.chunk
+        if offset is None:
+            self.stat = st
+        return offset
+
 def sanitize_text(t, tabsize):
     if t.endswith('\n'):
         t = t[:-1]
@@ -232,23 +966,194 @@ def sanitize_text(t, tabsize):
 class LineEditor(urwid.Edit):
     """Line editor with highligthing, column numbering, and smart home."""
     def __init__(self, edit_text="", lexer=None, main_display=None, smart_home=True,
-                 tabsize=None, **kwargs):
+                 tabsize=None, disk_line=None, **kwargs):
         self.original_text = edit_text
-        super().__init__(edit_text=sanitize_text(edit_text, tabsize), **kwargs)
+        self.disk_line = disk_line  # line number in the file on disk, if read
+        self.chunk_tokens = {}
+        self.hscroll = 0
+        self.text_version = 0
+        self.folded = 0  # number of lines hidden below this one
+        self._attrib_cache = None
+        self._bracket_cache = None
+        # kept so that unchanged lines are recognized without re-expanding tabs
+        self.expanded_text = sanitize_text(edit_text, tabsize)
+        super().__init__(edit_text=self.expanded_text, **kwargs)
         if lexer is None:
-            lexer = guess_lexer(self.get_edit_text())
+            main_display.walker._ensure_lexer()
+            lexer = main_display.walker.lexer
         self.lexer = lexer
         self.tabsize = tabsize
         self.main_display = main_display
         self.walker = main_display.walker
         self.smart_home = smart_home
+        if self.walker.words is not None:
+            self.walker.words.dirty.add(self)
+        if self.walker.gutter is not None and disk_line is None:
+            self.walker.gutter.dirty.add(self)
+
+    def is_long(self):
+        return len(self.edit_text) > self.walker.long_line
+
+    def gutter(self):
+        """Returns the markup of the diff gutter, which takes up the caption."""
+        gutter = self.walker.gutter
+        if gutter is None:
+            return []
+        mark = gutter.mark(self)
+        return [(GUTTER_ATTRS[mark], mark)]
 
     def get_text(self):
+        text, attrib = self._get_text()
+        gutter = self.gutter()
+        if gutter:
+            attr, mark = gutter[0]
+            return mark + text, [(attr, 1)] + attrib
+        return text, attrib
+
+    def _get_text(self):
         etext = self.get_edit_text()
-        tokens = self.walker.get_tokens(self)
-        attrib = [(tok, len(s)) for tok, s in tokens]
+        if self.is_long():
+            return etext, []  # long lines are rendered a span at a time
+        # attributes are reused until the text or the token cache changes
+        key = (self.text_version, self.walker.token_generation)
+        cache = self._attrib_cache
+        if cache is None or cache[0] != key:
+            tokens = self.walker.get_tokens(self)
+            attrib = [(tok, len(s)) for tok, s in tokens]
+            self._attrib_cache = cache = (key, attrib)
+        attrib = cache[1]
+        if self in self.walker.selected:
+            return etext, [('select', len(etext))]
+        cols = self.walker.matched.get(self)
+        if cols is not None:
+            attrib = highlight_columns(attrib, cols, 'match')
+        if self.folded:
+            fold = " ... {0} lines".format(self.folded)
+            return etext + fold, attrib + [('fold', len(fold))]
         return etext, attrib
 
+    def get_brackets(self):
+        """Returns the (col, char) of the brackets in the line, leaving out
+        those in strings and comments. This is cached until the text changes.
+        Long lines are not lexed, so all of their brackets are returned.
+        """
+        cache = self._bracket_cache
+        if cache is not None and cache[0] == self.text_version:
+            return cache[1]
+        if self.is_long():
+            finditer = RE_BRACKETS.finditer(self.edit_text)
+            brackets = [(m.start(), m.group()) for m in finditer]
+        else:
+            brackets = []
+            col = 0
+            for tok, s in self.walker.get_tokens(self):
+                if tok not in Token.String and tok not in Token.Comment:
+                    for m in RE_BRACKETS.finditer(s):
+                        brackets.append((col + m.start(), m.group()))
+                col += len(s)
+        self._bracket_cache = (self.text_version, brackets)
+        return brackets
+
+    def is_unchanged(self):
+        """Whether the text is the same as what was read from the file. This
+        is an identity check unless the line has been edited.
+        """
+        return self.original_text is not None and self.expanded_text == self.edit_text
+
+    def set_edit_text(self, text):
+        self.chunk_tokens = {}
+        self.text_version += 1
+        super().set_edit_text(text)
+        walker = getattr(self, 'walker', None)  # not set while initializing
+        if walker is None:
+            return
+        walker.edit_version += 1
+        alltokens = walker.all_tokens
+        if alltokens is not None:
+            pos = walker.get_pos(self)
+            if pos is not None and pos < len(alltokens):
+                alltokens[pos] = None  # relex this line on the next render
+        if walker.journaling:
+            walker.journal_dirty.add(self)
+        if walker.words is not None:
+            walker.words.dirty.add(self)
+        if walker.gutter is not None:
+            walker.gutter.dirty.add(self)
+
+    # long line support, only the columns on screen are lexed and laid out
+    def _shift_to_cursor(self, maxcol):
+        start = self.hscroll
+        pos = self.edit_pos
+        if pos < start:
+            start = pos
+        elif pos >= start + maxcol:
+            start = pos - maxcol + 1
+        self.hscroll = start
+        return start
+
+    def render(self, size, focus=False):
+        if self.walker.columns is not None and not focus:
+            return self.render_columns(size)
+        if not self.is_long():
+            return super().render(size, focus=focus)
+        (maxcol,) = size
+        gutter = self.gutter()
+        start = self._shift_to_cursor(maxcol - len(gutter))
+        end = start + maxcol - len(gutter)
+        markup = gutter + (self.walker.get_span_tokens(self, start, end) or [])
+        canv = urwid.Text(markup or "", wrap='clip').render((maxcol,))
+        if focus:
+            canv = urwid.CompositeCanvas(canv)
+            canv.cursor = self.get_cursor_coords(size)
+        return canv
+
+    def rows(self, size, focus=False):
+        if self.walker.columns is None and not self.is_long():
+            return super().rows(size, focus=focus)
+        return 1
+
+    def render_columns(self, size):
+        """Renders the cells of a delimited row aligned to the walker's column
+        widths. The focused row is edited as plain text.
+        """
+        (maxcol,) = size
+        sep, widths = self.walker.columns
+        if self.is_unchanged() or sep != '\t':
+            raw = self.original_text if self.is_unchanged() else self.edit_text
+        else:
+            raw = retab_lines([self.edit_text], self.tabsize)[0]
+        cells = split_cells(raw, sep)
+        cells = [c[:w].ljust(w) for c, w in zip(cells, widths)] + cells[len(widths):]
+        markup = self.gutter() + [" \u2502 ".join(cells)]
+        return urwid.Text(markup, wrap='clip').render((maxcol,))
+
+    def get_cursor_coords(self, size):
+        if not self.is_long():
+            return super().get_cursor_coords(size)
+        (maxcol,) = size
+        ncap = len(self.caption)
+        start = self._shift_to_cursor(maxcol - ncap)
+        x = ncap + urwid.calc_width(self.edit_text, start, self.edit_pos)
+        return min(x, maxcol - 1), 0
+
+    def move_cursor_to_coords(self, size, x, y):
+        if not self.is_long():
+            return super().move_cursor_to_coords(size, x, y)
+        if y != 0:
+            return False
+        (maxcol,) = size
+        if x == urwid.LEFT:
+            pos = 0
+        elif x == urwid.RIGHT:
+            pos = len(self.edit_text)
+        else:
+            x = max(x - len(self.caption), 0)
+            pos = min(self.hscroll + x, len(self.edit_text))
+        self.edit_pos = pos
+        self.pref_col_maxcol = x, maxcol
+        self._invalidate()
+        return True
+
     def insert_text(self, text):
         self.walker.all_tokens = None
         super().insert_text(text)
@@ -282,19 +1187,42 @@ class GotoEditor(urwid.Edit):
         main_display.walker.goto(int(line), int(col or 1))
 
 class DequeEditor(urwid.Edit):
-    """An editor that uses values from a deque or list.  Useful for histories."""
+    """An editor that uses values from a deque or list.  Useful for histories.
+    Tab completes the text to the most recent matching value, and pressing it
+    again cycles through older ones.
+    """
     def __init__(self, deq=None, **kwargs):
         super().__init__(**kwargs)
         self.deq = deq
         self.i = self.max_i = len(deq)  # index
         self.orig_text = ""
+        self.matches = None
 
     def text_at(self, i):
         return self.deq[i]
 
+    def prefixed(self, prefix):
+        """Returns the values that start with prefix, most recent first."""
+        if hasattr(self.deq, 'prefixed'):
+            return self.deq.prefixed(prefix)
+        texts = [self.text_at(i) for i in range(len(self.deq) - 1, -1, -1)]
+        return [t for t in texts if t.startswith(prefix)]
+
     def keypress(self, size, key):
         rtn = super().keypress(size, key)
-        if key == "up":
+        if key != "tab":
+            self.matches = None
+        if key == "tab":
+            if self.matches is None:
+                self.matches = self.prefixed(self.edit_text)
+                self.j = 0
+            if len(self.matches) > 0:
+                text = self.matches[self.j % len(self.matches)]
+                self.set_edit_text(text)
+                self.set_edit_pos(len(text))
+                self.j += 1
+            rtn = None
+        elif key == "up":
             i = self.i
             if i == self.max_i:
                 self.orig_text = self.edit_text
@@ -315,16 +1243,14 @@ class DequeEditor(urwid.Edit):
 class QueryEditor(DequeEditor):
     """Sets a (compiled) regular expression on the main body."""
     def run(self, main_display):
+        q = self.get_edit_text()
         try:
-            q = re.compile(self.get_edit_text())
+            re.compile(q)
         except re.error:
             return "re fail "
         main_display.queries.append(q)
         return main_display.seek_match()
 
-    def text_at(self, i):
-        return self.deq[i].pattern
-
 class NameCompleteEditor(DequeEditor):
     """Name Complete Editor Testing stage at this point"""
     def run(self, main_display):
@@ -334,6 +1260,20 @@ class NameCompleteEditor(DequeEditor):
     def text_at(self, i):
         return self.deq[i]
 
+class JumpListEditor(DequeEditor):
+    """Steps through project search hits, which may still be streaming in."""
+    def keypress(self, size, key):
+        if self.i == self.max_i:
+            self.i = len(self.deq)
+        self.max_i = len(self.deq)
+        return super().keypress(size, key)
+
+    def run(self, main_display):
+        m = RE_JUMP.match(self.get_edit_text())
+        if m is None:
+            return "no hit  "
+        return main_display.open_file(*path_line_col(m.group(1)))
+
 class ReplacementEditor(DequeEditor):
     """Sets a replacement string on the main body."""
     def run(self, main_display):
@@ -348,8 +1288,21 @@ class StyleSelectorEditor(urwid.Edit):
             s = pygments_cache.get_style_by_name(self.edit_text.strip())
         except pygments.util.ClassNotFound:
             return "bad sty "
+        main_display.style = self.edit_text.strip()
         main_display.register_palette(s)
 
+class ChangedFileEditor(urwid.Edit):
+    """Asks what to do about a file that changed on disk since it was read."""
+    def run(self, main_display):
+        choice = self.edit_text.strip()[:1].lower()
+        if choice == 'r':
+            return main_display.reload_file()
+        elif choice == 'm':
+            return main_display.merge_file()
+        elif choice == 'o':
+            return main_display.save()
+        return "changed "
+
 class FileSelectorEditor(urwid.Edit):
     """Editor to select file from filesystem."""
 
@@ -386,34 +1339,77 @@ class LineWalker(urwid.ListWalker):
     """ListWalker-compatible class for lazily reading file contents."""
 
     def __init__(self, name, main_display, tabsize, multiline_window=1500,
-                 number_of_windows=1):
+                 number_of_windows=1, follow=False, long_line=4096,
+                 long_line_chunk=1024):
         self.name = name
-        self.file = f = open(name)
+        stream = name == STDIN_NAME
+        # a stream starts out as an empty line that arriving text is added to
+        self.file = io.StringIO() if stream else open_text(name)
+        self.guess_lexer = stream  # the first data picks the lexer
+        self.follow = follow
+        self.columns = None  # (separator, widths) when showing aligned columns
+        self.edit_version = 0
+        self.matched = {}  # widget -> highlighted columns
+        self.mark = None  # line index that the marked block starts at
+        self.selected = set()  # widgets of the marked lines
+        self.words = None  # WordIndex, built on the first completion
+        self.gutter = None  # DiffGutter against the last commit
+        self.completion = None  # state for cycling through completions
+        self.folds = {}  # first line of a fold -> last line that it hides
+        self.fold_starts = {}  # last line hidden by a fold -> first line of the fold
+        self.journal = None
+        self.journaling = False
+        self.journal_dirty = set()
+        self.journal_interval = 1.0
+        self.tail = None
+        self.tail_stat = None if stream else os.stat(name)
+        # followed files are expected to change on disk
+        self.stamp = None if stream or follow else FileStamp(name)
         self.lines = []
+        self.nread = 0
         self.focus = 0
-        self.clipboard = None
+        self.clipboard = None  # texts of the cut or copied lines
         self.clipboard_pos = None
         self.lexer = None
         self.w_pos = {}
+        self.token_generation = 0
+        self.highlighted = None  # token generation of whole file tokens
         self.all_tokens = None
-        self._etext = lambda w: w.edit_text
+        # long lines are left out of multi-line lexing
+        self._etext = lambda w: "" if w.is_long() else w.edit_text
         self.multiline_window = multiline_window
+        self.long_line = long_line
+        self.long_line_chunk = long_line_chunk
         self.number_of_windows = number_of_windows
         self.main_display = main_display
         self.line_kwargs = dict(caption="", allow_tab=True, lexer=None,
                                 wrap='clip', main_display=main_display,
                                 smart_home=True, tabsize=tabsize)
 
-    def _ensure_lexer(self):
+    @property
+    def all_tokens(self):
+        """Per-line token cache, None when it needs to be recomputed."""
+        return self._all_tokens
+
+    @all_tokens.setter
+    def all_tokens(self, value):
+        if value is None:
+            # lets widgets know that their cached attributes are stale
+            self.token_generation += 1
+        self._all_tokens = value
+
+    def _ensure_lexer(self, first_line=""):
         if self.lexer is not None:
             return
-        try:
-            lexer = pygments_cache.get_lexer_for_filename(self.name)
-        except pygments.util.ClassNotFound:
-            lexer = TextLexer()
-        lexer = Python3Lexer() if isinstance(lexer, PythonLexer) else lexer
-        lexer.add_filter(NonEmptyFilter())
-        lexer.add_filter('tokenmerge')
+        path = self.main_display.session.get('lexer')
+        lexer = None
+        if path is not None:
+            try:
+                lexer = pooled_lexer(*path)
+            except (ImportError, AttributeError):
+                pass  # pygments has changed since
+        if lexer is None:
+            lexer = lexer_for_filename(self.name, first_line)
         self.lexer = self.line_kwargs['lexer'] = lexer
 
     def get_pos(self, w):
@@ -441,26 +1437,237 @@ class LineWalker(urwid.ListWalker):
 
     def get_next(self, start_from):
         self.main_display.reset_status()
+        if self.folds and 0 <= start_from < len(self.lines):
+            # jump over the hidden lines of a fold
+            w = self.lines[start_from]
+            if w in self.folds:
+                pos = self.get_pos(self.folds[w])
+                if pos is not None:
+                    return self._get_at_pos(pos + 1)
         return self._get_at_pos(start_from + 1)
 
     def get_prev(self, start_from):
         self.main_display.reset_status()
+        if self.fold_starts and 0 < start_from <= len(self.lines):
+            start = self.fold_starts.get(self.lines[start_from - 1])
+            if start is not None:
+                pos = self.get_pos(start)
+                if pos is not None:
+                    return start, pos
         return self._get_at_pos(start_from - 1)
 
     def read_next_line(self):
         """Read another line from the file."""
         next_line = self.file.readline()
         if not next_line or next_line[-1:] != '\n':
-            self.file = None  # no newline on last line of file
+            # no newline on last line of file, keep the handle around if following
+            self.tail = self.file if self.follow else None
+            self.file = None
         else:
             next_line = next_line[:-1]  # trim newline characters
-        self._ensure_lexer()
-        edit = LineEditor(edit_text=next_line, **self.line_kwargs)
+        self._ensure_lexer(next_line)
+        edit = LineEditor(edit_text=next_line, disk_line=self.nread, **self.line_kwargs)
         edit.set_edit_pos(0)
         self.w_pos[edit] = len(self.lines)
         self.lines.append(edit)
+        self.nread += 1
         return next_line
 
+    def poll_tail(self):
+        """Reads data appended to a followed file since the last poll. Returns
+        the number of lines that were added. If the file was truncated or rotated,
+        it is re-read from the top.
+        """
+        tail = self.tail
+        if tail is None:
+            return 0  # not following or still lazily reading the file
+        try:
+            st = os.stat(self.name)
+        except OSError:
+            return 0  # rotated, but the new file has not appeared yet
+        old = self.tail_stat
+        if (st.st_ino, st.st_dev) != (old.st_ino, old.st_dev) or \
+                st.st_size < tail.tell():
+            self.reopen()
+            return len(self.lines)
+        return self.extend(tail.read())
+
+    def extend(self, data):
+        """Adds text to the end of the file, where the last line is always
+        partial. Returns the number of lines that were added.
+        """
+        if not data:
+            return 0
+        # the last line is always partial, so the first chunk extends it
+        spl = data.split('\n')
+        self._ensure_read_in(len(self.lines) + 1)
+        last = self.lines[-1]
+        if last.is_unchanged():
+            last.original_text += spl[0]
+            last.expanded_text = sanitize_text(last.original_text, last.tabsize)
+            last.set_edit_text(last.expanded_text)
+        else:
+            # keep the edits, and a line that was typed in stays new
+            if last.original_text is not None:
+                last.original_text += spl[0]
+            last.set_edit_text(sanitize_text(last.edit_text + spl[0], last.tabsize))
+        self._ensure_lexer()
+        lines = self.lines
+        for rawline in spl[1:]:
+            edit = LineEditor(edit_text=rawline, **self.line_kwargs)
+            edit.set_edit_pos(0)
+            self.w_pos[edit] = len(lines)
+            lines.append(edit)
+        n = len(spl) - 1
+        self.nread += n
+        if self.guess_lexer and n > 0:
+            # the first line is complete, so a shebang can pick the lexer
+            self.guess_lexer = False
+            self.lexer = None
+            self._ensure_lexer(self.lines[0].original_text or '')
+            self.all_tokens = None
+        alltokens = self.all_tokens
+        if alltokens is not None:
+            # only the extended line and the new lines need to be lexed
+            alltokens[len(alltokens)-1:] = [None] * (n + 1)
+        self._modified()
+        return n
+
+    def reopen(self):
+        """Drops all lines and starts reading the file from the top again."""
+        for f in (self.file, self.tail):
+            if f is not None:
+                f.close()
+        self.file = open_text(self.name)
+        self.tail = None
+        self.tail_stat = os.stat(self.name)
+        if self.stamp is not None:
+            self.stamp = FileStamp(self.name)
+        self.lines.clear()
+        self.nread = 0
+        self.w_pos.clear()
+        self.words = None
+        self.folds.clear()
+        self.fold_starts.clear()
+        self.all_tokens = None
+        self.focus = 0
+        self._ensure_read_in(0)  # the focus line, which is never missing
+        self._modified()
+
+    def _lines_before(self, offset, nmax):
+        """Returns how many lines, up to nmax, end before the byte offset in
+        the file, and the byte offset that the next line starts at.
+        """
+        n = start = pos = 0
+        with open(self.name, 'rb') as f:
+            while pos < offset and n < nmax:
+                block = f.read(min(2**20, offset - pos))
+                if not block:
+                    break
+                c = block.count(b'\n')
+                if n + c >= nmax:
+                    i = -1
+                    for _ in range(nmax - n):
+                        i = block.index(b'\n', i + 1)
+                    return nmax, pos + i + 1
+                if c > 0:
+                    n += c
+                    start = pos + block.rindex(b'\n') + 1
+                pos += len(block)
+        return n, start
+
+    def _replace_lines(self, lo, lines):
+        """Puts lines in place of those from lo on, dropping the folds,
+        marks, and index entries that the old lines had.
+        """
+        for start in list(self.folds):
+            self.unfold(start)
+        kept = set(lines)
+        self._forget([w for w in self.lines[lo:] if w not in kept])
+        self.lines[lo:] = lines
+        self.w_pos = {w: i for i, w in enumerate(self.lines)}
+        self.matched.clear()
+        self.selected.clear()
+        self.mark = None
+        self.completion = None
+        self.all_tokens = None
+        self.focus = max(min(self.focus, len(self.lines) - 1), 0)
+
+    def reload(self, offset=0):
+        """Reads the file again after it changed on disk from the byte offset
+        on. Unless lines were edited, the ones that end before the offset are
+        kept, along with their widgets and index entries, and the rest is read
+        in lazily again.
+        """
+        keep = start = 0
+        if offset > 0 and compression_of(self.name) is None and \
+                not self.is_modified():
+            keep, start = self._lines_before(offset, len(self.lines))
+        for f in (self.file, self.tail):
+            if f is not None:
+                f.close()
+        focus = self.focus
+        self.file = open_text(self.name)
+        if start > 0:
+            self.file.seek(start)  # a line start, where the decoder has no state
+        self.tail = None
+        self.tail_stat = os.stat(self.name)
+        self.stamp = FileStamp(self.name)
+        self._replace_lines(keep, [])
+        self.nread = keep
+        for i, w in enumerate(self.lines):
+            w.disk_line = i
+        self._ensure_read_in(focus)
+        self.focus = min(focus, len(self.lines) - 1)
+        self._modified()
+
+    def merge(self):
+        """Merges the edited lines into the file as it is now on disk. Lines
+        that were not edited take on the text on disk, while edited and new
+        lines are kept. Where both sides changed the same lines, both are kept,
+        the edited ones first. Returns the number of such conflicts.
+        """
+        self._ensure_read_in(sys.maxsize)
+        with open_text(self.name) as f:
+            theirs = f.read().split('\n')
+        self.tail_stat = os.stat(self.name)
+        self.stamp = FileStamp(self.name)
+        ours = self.lines
+        # lines are matched up by the text they had when they were read
+        base = [w.original_text if w.original_text is not None else w
+                for w in ours]
+        kwargs = dict(self.line_kwargs, lexer=self.lexer)
+        merged = []
+        conflicts = 0
+        sm = difflib.SequenceMatcher(None, base, theirs)
+        for op, i1, i2, j1, j2 in sm.get_opcodes():
+            if op == 'equal':
+                for w, j in zip(ours[i1:i2], range(j1, j2)):
+                    w.disk_line = j
+                merged.extend(ours[i1:i2])
+                continue
+            # the lines on our side were changed or deleted on disk
+            edited = [w for w in ours[i1:i2] if not w.is_unchanged()]
+            if any(w.original_text is not None for w in edited):
+                conflicts += 1
+            for w in edited:
+                w.disk_line = None
+            merged.extend(edited)
+            merged.extend(LineEditor(edit_text=theirs[j], disk_line=j, **kwargs)
+                          for j in range(j1, j2))
+        for f in (self.file, self.tail):
+            if f is not None:
+                f.close()
+        self.file = self.tail = None
+        self._replace_lines(0, merged)
+        self.nread = len(theirs)
+        self.reset_journal()
+        # the journal is relative to the file on disk, which is now theirs
+        self._journal('del', 0, len(theirs))
+        self._journal('ins', 0, [w.edit_text for w in merged])
+        self._modified()
+        return conflicts
+
     def _get_at_pos(self, pos):
         """Return a widget for the line number passed."""
         if pos < 0:
@@ -482,11 +1689,342 @@ class LineWalker(urwid.ListWalker):
         if n >= 2:
             self.all_tokens = None
 
+    # bracket matching
+    def find_match(self, limit=None):
+        """Returns the (line, col) of the bracket matching the one under the
+        cursor, or None. The lines are searched outward from the cursor, using
+        the brackets cached on each line, and read in as needed. A limit stops
+        the search after that many lines, which is for highlighting while idle;
+        jumps search as far as the match is.
+        """
+        focus = self.focus
+        w = self.lines[focus]
+        col = w.edit_pos
+        c = w.edit_text[col:col+1]
+        if (col, c) not in w.get_brackets():
+            return None  # not a bracket, or one in a string or comment
+        forward = c in BRACKETS
+        opens = (lambda a, b: BRACKETS[a] == b) if forward else \
+                (lambda a, b: BRACKETS[b] == a)
+        stack = []
+        i = focus
+        n = 0
+        while limit is None or n <= limit:
+            n += 1
+            brackets = self.lines[i].get_brackets()
+            if i == focus:
+                brackets = [b for b in brackets if (b[0] > col) == forward and b[0] != col]
+            for bcol, b in brackets if forward else reversed(brackets):
+                if (b in BRACKETS) == forward:
+                    stack.append(b)
+                elif len(stack) > 0:
+                    if opens(stack[-1], b):
+                        stack.pop()
+                elif opens(c, b):
+                    return i, bcol
+            i += 1 if forward else -1
+            if i < 0:
+                return None
+            if i >= len(self.lines):
+                self._ensure_read_in(i)
+                if i >= len(self.lines):
+                    return None
+        return None
+
+    def highlight_match(self, limit=1000):
+        """Highlights the bracket under the cursor and its match."""
+        match = self.find_match(limit=limit)
+        matched = {}
+        if match is not None:
+            for line, col in ((self.focus, self.lines[self.focus].edit_pos), match):
+                matched.setdefault(self.lines[line], []).append(col)
+        if matched == self.matched:
+            return
+        for w in set(self.matched) | set(matched):
+            w._invalidate()
+        self.matched = matched
+
+    # blocks of lines
+    def selection(self):
+        """Returns the (start, stop) line indices of the marked block, or of the
+        current line when there is no mark.
+        """
+        if self.mark is None:
+            return self.focus, self.focus + 1
+        lo, hi = sorted((min(self.mark, len(self.lines) - 1), self.focus))
+        return lo, hi + 1
+
+    # folding
+    def block_end(self, pos):
+        """Returns the index of the line after the block that starts on line
+        pos, or None when there is no block. A line that ends by opening a
+        bracket starts a block that runs to the line closing it, otherwise the
+        block is the lines that are indented deeper than the first.
+        """
+        w = self.lines[pos]
+        text = w.edit_text.rstrip()
+        depth = 0
+        if text[-1:] in BRACKETS:
+            # brackets in strings and comments are left out by the lexer
+            for col, c in w.get_brackets():
+                depth += 1 if c in BRACKETS else -1
+        if depth > 0:
+            i = pos
+            while depth > 0:
+                i += 1
+                self._ensure_read_in(i)
+                if i >= len(self.lines):
+                    return None  # never closed
+                for col, c in self.lines[i].get_brackets():
+                    depth += 1 if c in BRACKETS else -1
+            end = i  # the closing line stays visible
+        else:
+            indent = len(text) - len(text.lstrip())
+            i = end = pos + 1
+            while True:
+                self._ensure_read_in(i)
+                if i >= len(self.lines):
+                    break
+                t = self.lines[i].edit_text
+                if t.strip():
+                    if len(t) - len(t.lstrip()) <= indent:
+                        break
+                    end = i + 1  # trailing blank lines stay visible
+                i += 1
+        return end if end > pos + 1 else None
+
+    def fold(self, pos, end):
+        """Hides the lines after pos and before end, folds inside are undone.
+        The fold ends on its last line, rather than before the next, so lines
+        that are added to the end of the file later are not hidden by it.
+        """
+        self.unfold_lines(pos, end - 1)
+        start, last = self.lines[pos], self.lines[end - 1]
+        self.folds[start] = last
+        self.fold_starts[last] = start
+        start.folded = end - pos - 1
+        start._invalidate()
+        self._modified()
+
+    def unfold(self, start):
+        last = self.folds.pop(start)
+        self.fold_starts.pop(last, None)
+        start.folded = 0
+        start._invalidate()
+        self._modified()
+
+    def unfold_lines(self, lo, hi):
+        """Undoes the folds that start on the lines lo through hi, and those
+        that end on them or right above them.
+        """
+        if not self.folds:
+            return
+        for i in range(max(lo - 1, 0), hi + 1):
+            w = self.lines[i] if i < len(self.lines) else None
+            if i >= lo and w in self.folds:
+                self.unfold(w)
+            if w in self.fold_starts:
+                self.unfold(self.fold_starts[w])
+
+    def reveal(self, pos):
+        """Undoes the fold that hides line pos, if any."""
+        for start, last in list(self.folds.items()):
+            lo = self.get_pos(start)
+            hi = self.get_pos(last)
+            if lo is None or hi is None:
+                self.unfold(start)  # a line of the fold was deleted
+            elif lo < pos <= hi:
+                self.unfold(start)
+
+    def toggle_fold(self):
+        """Folds the block that starts on the current line, or unfolds it.
+        Returns whether there was a block.
+        """
+        w = self.lines[self.focus]
+        if w in self.folds:
+            self.unfold(w)
+            return True
+        end = self.block_end(self.focus)
+        if end is None:
+            return False
+        self.fold(self.focus, end)
+        return True
+
+    def toggle_fold_all(self):
+        """Folds every block that starts at the left margin, or unfolds all
+        the folds when there are some.
+        """
+        if self.folds:
+            for start in list(self.folds):
+                self.unfold(start)
+            return
+        self._ensure_read_in(sys.maxsize)
+        i = 0
+        while i < len(self.lines):
+            text = self.lines[i].edit_text
+            end = None
+            if text.strip() and not text[:1].isspace():
+                end = self.block_end(i)
+            if end is None:
+                i += 1
+                continue
+            self.fold(i, end)
+            i = end
+        self.reveal(self.focus)
+
+    def toggle_mark(self):
+        self.mark = self.focus if self.mark is None else None
+
+    def highlight_selection(self):
+        """Marks the lines of the block for display, redrawing only the lines
+        that went in or out of it.
+        """
+        selected = set()
+        if self.mark is not None:
+            selected.update(self.lines[slice(*self.selection())])
+        for w in selected.symmetric_difference(self.selected):
+            w._invalidate()
+        self.selected = selected
+
+    def edit_block(self, func):
+        """Applies func to the text of each line of the block, as one edit
+        with a single token invalidation.
+        """
+        self.all_tokens = None
+        for w in self.lines[slice(*self.selection())]:
+            text = func(w.edit_text)
+            if text != w.edit_text:
+                w.set_edit_text(text)
+        self.all_tokens = None
+
+    def indent_block(self, tabsize):
+        self.edit_block(lambda t: ' ' * tabsize + t if t else t)
+
+    def dedent_block(self, tabsize):
+        def dedent(t):
+            n = len(t) - len(t.lstrip(' '))
+            return t[min(n, tabsize):]
+        self.edit_block(dedent)
+
+    def comment_block(self, prefix):
+        """Comments out the block, or uncomments it when every non-blank line
+        already is.
+        """
+        texts = [w.edit_text for w in self.lines[slice(*self.selection())]]
+        texts = [t for t in texts if t.strip()]
+        if len(texts) == 0:
+            return
+        if all(t.lstrip().startswith(prefix) for t in texts):
+            def uncomment(t):
+                i = t.find(prefix)
+                if i < 0 or t[:i].strip():
+                    return t
+                j = i + len(prefix)
+                j += t[j:j+1] == ' '
+                return t[:i] + t[j:]
+            self.edit_block(uncomment)
+        else:
+            indent = min(len(t) - len(t.lstrip()) for t in texts)
+            self.edit_block(lambda t: t[:indent] + prefix + ' ' + t[indent:]
+                                      if t.strip() else t)
+
+    def copy_block(self):
+        """Copies the text of the block to the clipboard, as it is now."""
+        self.clipboard = [w.edit_text for w in self.lines[slice(*self.selection())]]
+        self.clipboard_pos = None
+        self.mark = None
+
+    def cut_block(self):
+        """Cuts the block to the clipboard, as one edit."""
+        lo, hi = self.selection()
+        hi = min(hi, len(self.lines) - 1)  # don't cut last line
+        self.mark = None
+        if hi <= lo:
+            return
+        self.unfold_lines(lo, hi)
+        self._journal('del', lo, hi - lo)
+        self.all_tokens = None
+        cut = self.lines[lo:hi]
+        self.clipboard = [w.edit_text for w in cut]
+        self.clipboard_pos = None
+        del self.lines[lo:hi]
+        for w in cut:
+            self.w_pos.pop(w, None)
+        self._forget(cut)
+        self._removed_at(lo)
+        self.set_focus(lo)
+
+    # crash recovery
+    def flush_journal(self):
+        """Records the current text of the lines edited since the last flush.
+        Typing only marks lines as dirty, so this is what keeps keystrokes cheap.
+        """
+        dirty = self.journal_dirty
+        if len(dirty) == 0:
+            return
+        for w in dirty:
+            pos = self.get_pos(w)
+            if pos is not None:
+                self._journal('set', pos, w.edit_text)
+        dirty.clear()
+
+    def _journal(self, *rec):
+        if not self.journaling:
+            return
+        if rec[0] != 'set':
+            self.flush_journal()  # line numbers must be recorded in order
+        if self.journal is None:
+            self.journal = Journal(self.name, self.tail_stat, self.journal_interval)
+        self.journal.record(rec)
+
+    def reset_journal(self, remove=True):
+        """Closes the journal, after a save or a clean exit."""
+        self.journal_dirty.clear()
+        if self.journal is not None:
+            self.journal.close(remove=remove)
+            self.journal = None
+        elif remove and os.path.isfile(journal_path(self.name)):
+            os.remove(journal_path(self.name))
+
+    def replay(self, records):
+        """Applies journaled edits to the file's lines."""
+        journaling, self.journaling = self.journaling, False
+        for rec in records:
+            op, pos = rec[0], rec[1]
+            self._ensure_read_in(pos + 1)
+            if pos >= len(self.lines):
+                break  # journal does not fit the file
+            self.focus = pos
+            if op == 'set':
+                self.lines[pos].set_edit_text(rec[2])
+            elif op == 'split':
+                self.lines[pos].set_edit_pos(rec[2])
+                self.split_focus()
+            elif op == 'join':
+                self.combine_focus_with_next()
+            elif op == 'del':
+                self.all_tokens = None
+                n = rec[2] if len(rec) > 2 else 1
+                self._ensure_read_in(pos + n)
+                for w in self.lines[pos:pos + n]:
+                    self.w_pos.pop(w, None)
+                self._forget(self.lines[pos:pos + n])
+                del self.lines[pos:pos + n]
+                self._removed_at(pos)
+            elif op == 'ins':
+                self.insert_raw_lines(rec[2])
+                for w in self.lines[pos:pos + len(rec[2])]:
+                    w.original_text = None
+        self.focus = 0
+        self.journaling = journaling
+
     def split_focus(self):
         """Divide the focus edit widget at the cursor location."""
+        self.unfold_lines(self.focus, self.focus)
         self.all_tokens = None
         focus = self.lines[self.focus]
         pos = focus.edit_pos
+        self._journal('split', self.focus, pos)
         #self._ensure_lexer()
         edit = LineEditor(edit_text=focus.edit_text[pos:], **self.line_kwargs)
         edit.original_text = None
@@ -497,29 +2035,41 @@ class LineWalker(urwid.ListWalker):
 
     def combine_focus_with_prev(self):
         """Combine the focus edit widget with the one above."""
+        self.unfold_lines(self.focus, self.focus)
         self.all_tokens = None
         above, ignore = self.get_prev(self.focus)
         if above is None:
             return  # already at the top
+        self._journal('join', self.focus - 1)
         focus = self.lines[self.focus]
         above.set_edit_pos(len(above.edit_text))
         above.set_edit_text(above.edit_text + focus.edit_text)
+        self._forget([focus])
         del self.w_pos[self.lines[self.focus]]
         del self.lines[self.focus]
         self.focus -= 1
 
     def combine_focus_with_next(self):
         """Combine the focus edit widget with the one below."""
+        self.unfold_lines(self.focus, self.focus)
         self.all_tokens = None
         below, ignore = self.get_next(self.focus)
         if below is None:
             return  # already at bottom
+        self._journal('join', self.focus)
         focus = self.lines[self.focus]
         focus.set_edit_text(focus.edit_text + below.edit_text)
+        self._forget([below])
         del self.w_pos[self.lines[self.focus+1]]
         del self.lines[self.focus+1]
 
     # Some nice functions
+    def is_modified(self):
+        """Whether the lines differ from what was read from the file."""
+        if len(self.lines) != self.nread:
+            return True
+        return not all(w.is_unchanged() for w in self.lines)
+
     def get_coords(self):
         """Returns the line & col position. These are 1-indexed."""
         focus = self.focus
@@ -529,6 +2079,8 @@ class LineWalker(urwid.ListWalker):
         """Jumps to a specific line & column.  These are 1-indexed."""
         self._ensure_read_in(lineno)
         focus = min(lineno, len(self.lines)) - 1
+        if self.folds:
+            self.reveal(focus)
         self.lines[focus].set_edit_pos(col - 1)
         self.set_focus(focus)
 
@@ -541,7 +2093,8 @@ class LineWalker(urwid.ListWalker):
         while m is None and last_pos != curr_pos:
             # search down the lines
             last_pos = curr_pos
-            w, curr_pos = self.get_next(curr_pos)
+            # folded lines are searched as well, goto unfolds them
+            w, curr_pos = self._get_at_pos(curr_pos + 1)
             if w is None:
                 m = None
                 break
@@ -549,7 +2102,7 @@ class LineWalker(urwid.ListWalker):
         if m is None:
            curr_pos = 0  # start from the top
         while m is None and curr_pos < orig_pos:
-            w, curr_pos = self.get_next(curr_pos)
+            w, curr_pos = self._get_at_pos(curr_pos + 1)
             m = q.search(w.get_edit_text())
         if m is None:
             return "0 res.  "
@@ -560,6 +2113,10 @@ class LineWalker(urwid.ListWalker):
         stat = self.seek_match(q)
         if stat is not None:
             return stat
+        self.replace_here(q, r)
+
+    def replace_here(self, q, r):
+        """Replaces the match to q that starts at the cursor."""
         w, ypos = self.get_focus()
         xpos = w.edit_pos
         text = w.edit_text
@@ -572,6 +2129,80 @@ class LineWalker(urwid.ListWalker):
         w, ypos = self.get_focus()
         w.insert_text(name)
 
+    # word completion
+    def word_index(self):
+        """Returns the up to date index of the words in the lines read in."""
+        if self.words is None:
+            self.words = WordIndex()
+            self.words.dirty.update(self.lines)
+        self.words.sync()
+        return self.words
+
+    def _forget(self, lines):
+        if self.words is not None:
+            for w in lines:
+                self.words.forget(w)
+        if self.gutter is not None:
+            for w in lines:
+                self.gutter.forget(w)
+
+    def _removed_at(self, pos):
+        """Lets the diff gutter know that lines were deleted above line pos."""
+        if self.gutter is not None and len(self.lines) > 0:
+            self.gutter.removed.add(self.lines[min(pos, len(self.lines) - 1)])
+
+    def complete_word(self):
+        """Completes the word before the cursor with the most common word in
+        the file that starts with it. Doing so again right away cycles through
+        the less common ones. Returns a status.
+        """
+        w = self.lines[self.focus]
+        pos = w.edit_pos
+        c = self.completion
+        if c is not None and c[0] is w and c[1] == (w.text_version, pos):
+            start, words, i = c[2], c[3], (c[4] + 1) % len(c[3])
+        else:
+            m = RE_WORD_END.search(w.edit_text, 0, pos)
+            if m is None:
+                return "no word "
+            start = m.start()
+            words = self.word_index().complete(m.group())
+            if len(words) == 0:
+                return "no comp "
+            i = 0
+        text = w.edit_text
+        w.set_edit_text(text[:start] + words[i] + text[pos:])
+        w.set_edit_pos(start + len(words[i]))
+        self.completion = (w, (w.text_version, w.edit_pos), start, words, i)
+        return "{0}/{1}".format(i + 1, len(words)).ljust(8)[:8]
+
+    def search_worker(self, pattern):
+        """Returns the function and arguments that search for pattern in a
+        worker process, and about how many lines it will look at. Lines that
+        have not been read are searched in the file, from where reading stopped,
+        unless the file cannot seek, as zstd streams cannot, when only the lines
+        read in are searched. The pattern is compiled here, so that re.error is
+        raised in the editor.
+        """
+        q = re.compile(pattern)
+        texts = [w.edit_text for w in self.lines]
+        w = self.lines[self.focus]
+        name = cookie = None
+        total = len(texts)
+        if self.file is not None and self.name != STDIN_NAME and self.file.seekable():
+            name, cookie = self.name, self.file.tell()
+            rest = max(os.path.getsize(name) - cookie, 0)
+            total += len(texts) * rest // max(cookie, 1)
+        args = (q, texts, self.focus, w.edit_pos, name, cookie,
+                self.line_kwargs['tabsize'])
+        return search_lines, args, total
+
+    def search_found(self, msg):
+        """Goes to what a search worker found, or returns a status."""
+        if msg[0] != 'found':
+            return "0 res.  "
+        self.goto(msg[1] + 1, msg[2] + 1)
+
     # tokenization
     def _compute_slice(self, pos, window, alltokens):
         llen = len(self.lines)
@@ -586,7 +2217,8 @@ class LineWalker(urwid.ListWalker):
         alltokens = self.all_tokens
         pos = self.get_pos(w)
         window = window or self.multiline_window
-        if len(self.lines) > window * self.number_of_windows:
+        whole = alltokens is not None and self.highlighted == self.token_generation
+        if len(self.lines) > window * self.number_of_windows and not whole:
             # Short circut windowing if we have too many lines.
             return self.get_basic_tokens(w)
         if alltokens is None:
@@ -605,23 +2237,45 @@ class LineWalker(urwid.ListWalker):
     def get_basic_tokens(self, w):
         return list(self.lexer.get_tokens(w.edit_text))
 
+    def get_span_tokens(self, w, start, end):
+        """Computes the tokens for the columns [start, end) of a long line. These
+        are lexed in fixed size chunks that are cached on the widget.
+        """
+        text = w.edit_text
+        end = min(end, len(text))
+        chunk = self.long_line_chunk
+        cache = w.chunk_tokens
+        tokens = []
+        for c in range(start // chunk, (end - 1) // chunk + 1):
+            ctoks = cache.get(c)
+            if ctoks is None:
+                ctext = text[c*chunk:(c+1)*chunk]
+                ctoks, n = [], len(ctext)
+                for tok, s in self.lexer.get_tokens(ctext):
+                    if n <= 0:
+                        break
+                    ctoks.append((tok, s[:n]))  # drops the newline pygments adds
+                    n -= len(s)
+                cache[c] = ctoks
+            i = c * chunk
+            for tok, s in ctoks:
+                j = i + len(s)
+                if j > start and i < end:
+                    tokens.append((tok, s[max(start - i, 0):end - i]))
+                i = j
+        return tokens
+
     def get_all_tokens(self, lines=None):
         lines = lines or self.lines
         viewtext = "\n".join(map(self._etext, lines))
-        ltokens = []
-        alltokens = []
-        for token, s in self.lexer.get_tokens(viewtext):
-            if len(s) == 0:
-                continue
-            if '\n' not in s:
-                ltokens.append((token, s))
-                continue
-            spl = s.split('\n')
-            ltokens.append((token, spl[0]))
-            for text in spl[1:]:
-                alltokens.append(ltokens)
-                ltokens = [(token, text)]
-        return alltokens
+        return token_lines(self.lexer.get_tokens(viewtext))
+
+    def set_all_tokens(self, alltokens):
+        """Installs tokens for every line, which were lexed as a whole file."""
+        self.all_tokens = None  # drops the attributes cached on the widgets
+        self.all_tokens = alltokens
+        self.highlighted = self.token_generation
+        self._modified()
 
     # Clipboard methods
     def cut_to_clipboard(self):
@@ -629,13 +2283,17 @@ class LineWalker(urwid.ListWalker):
         focus = self.focus
         if focus + 1 == len(self.lines):
            return  # don't cut last line
+        self.unfold_lines(focus, focus)
         self.all_tokens = None
         if (self.clipboard is None) or (self.clipboard_pos is None) or \
            (focus != self.clipboard_pos):
             self.clipboard = []
+        self._journal('del', focus)
         w = self.lines.pop(focus)
         del self.w_pos[w]
-        self.clipboard.append(w)
+        self._forget([w])
+        self._removed_at(focus)
+        self.clipboard.append(w.edit_text)
         self.clipboard_pos = focus
         self.set_focus(focus)
 
@@ -644,10 +2302,12 @@ class LineWalker(urwid.ListWalker):
         cb = self.clipboard
         if cb is None:
             return
+        self.unfold_lines(self.focus, self.focus)
+        self._journal('ins', self.focus, list(cb))
         self.all_tokens = None
-        for line in cb[::-1]:
+        for text in cb[::-1]:
             self.all_tokens = None
-            newline = LineEditor(edit_text=line.get_edit_text(), **self.line_kwargs)
+            newline = LineEditor(edit_text=text, **self.line_kwargs)
             newline.original_text = None
             self.lines.insert(self.focus, newline)
             self.w_pos[newline] = self.focus
@@ -658,9 +2318,39 @@ class LineWalker(urwid.ListWalker):
         """Removes the existing clipboard, destroying all lines in the process."""
         self.clipboard = self.clipboard_pos = None
 
-    def insert_raw_lines(self, rawlines):
+    def splice_text(self, text):
+        """Inserts text at the cursor all at once, however many lines it spans,
+        and leaves the cursor after it.
+        """
+        focus = self.lines[self.focus]
+        pos = focus.edit_pos
+        etext = focus.edit_text
+        spl = text.split('\n')
+        head = sanitize_text(etext[:pos] + spl[0], focus.tabsize)
+        if len(spl) == 1:
+            focus.set_edit_text(head + etext[pos:])
+            focus.set_edit_pos(len(head))
+            return
+        self.unfold_lines(self.focus, self.focus)
+        focus.set_edit_text(head)
+        rawlines = spl[1:]
+        rawlines[-1] += etext[pos:]
+        self._journal('ins', self.focus + 1, rawlines)
+        self.all_tokens = None
+        new = [LineEditor(edit_text=rawline, **self.line_kwargs) for rawline in rawlines]
+        for i, w in enumerate(new, self.focus + 1):
+            w.original_text = None
+            w.set_edit_pos(0)
+            self.w_pos[w] = i
+        new[-1].set_edit_pos(len(spl[-1]))
+        self.lines[self.focus + 1:self.focus + 1] = new
+        self.set_focus(self.focus + len(new))
+
+    def insert_raw_lines(self, rawlines):
         """Inserts strings at the current position."""
         pos = self.focus
+        self.unfold_lines(pos, pos)
+        self._journal('ins', pos, list(rawlines))
         rawlines.reverse()
         self.all_tokens = None
         for rawline in rawlines:
@@ -671,10 +2361,502 @@ class LineWalker(urwid.ListWalker):
         self.all_tokens = None
         rawlines.reverse()
 
+class ViewLine(urwid.Text):
+    """Highlighted, read-only line of text. Only lines on screen exist."""
+    def selectable(self):
+        return True
+
+    def keypress(self, size, key):
+        return key
+
+class ViewWalker(urwid.ListWalker):
+    """ListWalker for read-only viewing, which displays lines straight from a
+    memory map of the file. The newlines are counted a block at a time, as far
+    as they are needed, and the line starts are only found within the blocks
+    near the screen. The only per-line state is the widgets of those lines.
+    """
+    journaling = False
+    mark = None
+    stamp = None  # the view is never saved, so changes on disk do not matter
+    block = 2**16
+
+    def __init__(self, name, main_display, tabsize, max_width=4096, ncached=512):
+        self.name = name
+        self.main_display = main_display
+        self.tabsize = tabsize
+        self.max_width = max_width
+        self.ncached = ncached
+        self.focus = 0
+        self.lexer = None
+        self.cache = {}
+        with open(name, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self.mm = b''
+            else:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.counts = array('q', [0])  # number of newlines before each block
+        self.starts = {}  # block -> offsets of the lines that start in it
+        self.indexed = len(self.mm) == 0  # whether every newline is counted
+
+    def _index_to(self, lineno=None, offset=None):
+        """Counts newlines until line lineno, or the byte offset, is covered."""
+        mm = self.mm
+        counts = self.counts
+        block = self.block
+        while not self.indexed:
+            if lineno is not None and counts[-1] > lineno:
+                return
+            if offset is not None and (len(counts) - 1) * block > offset:
+                return
+            i = (len(counts) - 1) * block
+            counts.append(counts[-1] + mm[i:i+block].count(b'\n'))
+            self.indexed = i + block >= len(mm)
+
+    def _known_lines(self):
+        """The number of lines that are known to exist so far."""
+        return self.counts[-1] + 1
+
+    def _block_starts(self, k):
+        starts = self.starts.get(k)
+        if starts is None:
+            i = k * self.block
+            chunk = self.mm[i:i+self.block]
+            starts, j = [], chunk.find(b'\n')
+            while j >= 0:
+                starts.append(i + j + 1)
+                j = chunk.find(b'\n', j + 1)
+            if len(self.starts) >= self.ncached:
+                self.starts.clear()
+            self.starts[k] = starts
+        return starts
+
+    def line_start(self, lineno):
+        """Returns the byte offset of a line whose newlines were counted."""
+        if lineno == 0:
+            return 0
+        k = bisect.bisect_left(self.counts, lineno) - 1
+        return self._block_starts(k)[lineno - self.counts[k] - 1]
+
+    def line_of(self, offset):
+        """Returns the line that a byte offset is on, 0-indexed."""
+        self._index_to(offset=offset)
+        k = min(offset // self.block, len(self.counts) - 2)
+        return self.counts[k] + bisect.bisect_right(self._block_starts(k), offset)
+
+    def line_text(self, lineno):
+        """Returns the decoded text of a line, or None past the end."""
+        self._index_to(lineno=lineno)
+        if lineno >= self._known_lines():
+            return None
+        mm = self.mm
+        start = self.line_start(lineno)
+        stop = mm.find(b'\n', start, start + self.max_width)
+        stop = min(len(mm), start + self.max_width) if stop < 0 else stop
+        text = mm[start:stop].decode('utf-8', 'replace')
+        return sanitize_text(text.rstrip('\r'), self.tabsize)
+
+    def _get_at_pos(self, pos):
+        if pos < 0:
+            return None, None
+        w = self.cache.get(pos)
+        if w is None:
+            text = self.line_text(pos)
+            if text is None:
+                return None, None
+            if self.lexer is None:
+                self.lexer = lexer_for_filename(self.name, self.line_text(0))
+            markup = list(self.lexer.get_tokens(text))
+            if len(markup) > 0:  # pygments ends the text with a newline
+                tok, t = markup.pop()
+                t = t[:-1] if t.endswith('\n') else t
+                if t:
+                    markup.append((tok, t))
+            if len(self.cache) >= self.ncached:
+                self.cache.clear()
+            self.cache[pos] = w = ViewLine(markup or "", wrap='clip')
+        return w, pos
+
+    def get_focus(self):
+        return self._get_at_pos(self.focus)
+
+    def set_focus(self, focus):
+        self.focus = focus
+        self._modified()
+        self.main_display.reset_status()
+
+    def get_next(self, start_from):
+        return self._get_at_pos(start_from + 1)
+
+    def get_prev(self, start_from):
+        return self._get_at_pos(start_from - 1)
+
+    def get_coords(self):
+        return self.focus + 1, 1
+
+    def goto(self, lineno, col=1):
+        """Jumps to a specific line. This is 1-indexed."""
+        self._index_to(lineno=lineno - 1)
+        self.set_focus(max(min(lineno, self._known_lines()) - 1, 0))
+
+    def seek_match(self, q):
+        """Finds the next line that has the literal query q, by searching the
+        memory map itself. Regular expressions are run by search_worker.
+        """
+        start = self._search_start()
+        b = q.pattern.encode()
+        i = self.mm.find(b, start)
+        i = self.mm.find(b, 0, start) if i < 0 else i
+        return self.search_found(('found', i) if i >= 0 else ('none',))
+
+    def _search_start(self):
+        self._index_to(lineno=self.focus + 1)
+        return self.line_start(min(self.focus + 1, self._known_lines() - 1))
+
+    def search_worker(self, pattern):
+        """Returns the function and arguments that search the memory map in
+        a worker process. There is no progress to report for a single search.
+        The bytes form of the pattern is compiled here, so that re.error is
+        raised in the editor rather than in the worker.
+        """
+        bq = re.compile(pattern.encode(), re.MULTILINE)
+        return search_mmap, (bq, self.mm, self._search_start()), None
+
+    def search_found(self, msg):
+        if msg[0] != 'found':
+            return "0 res.  "
+        self.goto(self.line_of(msg[1]) + 1)
+
+    def is_modified(self):
+        return False
+
+    def reset_journal(self, remove=True):
+        pass
+
+class ProjectSearch(object):
+    """Searches the files under a directory with a process pool. Hits stream
+    into a deque from a background thread and notify() is called as they arrive.
+    The pattern is a compiled bytes regular expression. An error raised by a
+    worker ends the search and is kept in error.
+    """
+
+    def __init__(self, root, pattern, notify, processes=None, max_hits=10000):
+        self.root = root
+        self.pattern = pattern
+        self.notify = notify
+        self.processes = processes
+        self.max_hits = max_hits
+        self.hits = deque()
+        self.done = False
+        self.error = None
+        self.pool = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.done = True  # the pool is terminated by the search thread
+
+    def _run(self):
+        root = self.root
+        pattern = self.pattern
+        self.pool = pool = multiprocessing.Pool(self.processes)
+        args = ((os.path.join(root, f), pattern) for f in project_files(root))
+        try:
+            for hits in pool.imap_unordered(search_file, args, chunksize=64):
+                if self.done:
+                    break
+                if len(hits) == 0:
+                    continue
+                for path, line, col, text in hits:
+                    path = os.path.relpath(path, root)
+                    self.hits.append("{0}:{1}:{2}: {3}".format(path, line, col, text))
+                if len(self.hits) >= self.max_hits:
+                    break
+                self.notify()
+        except Exception as e:
+            self.error = e  # raised by a worker and passed on by the pool
+        finally:
+            pool.terminate()
+            self.done = True
+            self.notify()
+
+class StdinReader(object):
+    """Reads a pipe in a background thread. Decoded chunks of text pile up in
+    a deque until the main loop takes them, and notify() is called as they arrive.
+    """
+
+    def __init__(self, f, notify=None, chunk=2**16):
+        self.f = f
+        self.notify = notify
+        self.chunk = chunk
+        self.chunks = deque()
+        self.done = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        fd = self.f.fileno()
+        try:
+            while True:
+                data = os.read(fd, self.chunk)
+                text = decoder.decode(data, final=not data)
+                if text:
+                    self.chunks.append(text)
+                if not data:
+                    break
+                self.notify()
+        finally:
+            self.f.close()
+            self.done = True
+            self.notify()
+
+class RegexSearch(object):
+    """Runs a search in a forked worker process, which shares the text with
+    the editor. A pattern that backtracks without end can then be given a time
+    budget or be cancelled, and the editor stays responsive meanwhile.
+    """
+
+    def __init__(self, target, args, then=None, total=None):
+        ctx = multiprocessing.get_context('fork')
+        self.conn, self.child = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(target=search_child,
+                                   args=(target, self.child) + args, daemon=True)
+        self.then = then  # called after jumping to a hit
+        self.total = total
+        self.status = "srch    "
+
+    def start(self):
+        self.process.start()
+        self.child.close()
+
+    def cancel(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+    def receive(self):
+        """Reads the messages that have arrived. Returns the final one, or
+        None while the search is still running.
+        """
+        try:
+            while self.conn.poll():
+                msg = self.conn.recv()
+                if msg[0] != 'progress':
+                    return msg
+                if self.total:
+                    pct = min(100 * msg[1] // self.total, 99)
+                    self.status = "srch {0:>2}%".format(pct)
+        except (EOFError, OSError):
+            return ('none',)  # the worker died
+        return None
+
+class ParallelHighlight(object):
+    """Lexes the text of a whole file in chunks with a process pool, from a
+    background thread. Each chunk is lexed with the first line of the next one,
+    and where the two disagree on that line, the chunk did not end in the
+    lexer's root state, so the chunks are joined and lexed again. Agreeing on
+    one line does not prove that the states matched, so lexers that carry
+    state across many lines may still tokenize differently than a single
+    pass would. The tokens are in self.tokens when done, and notify() is
+    called then.
+    """
+
+    def __init__(self, lexer, texts, notify, processes=None):
+        self.path = _lexer_class_path(lexer)
+        self.texts = texts
+        self.notify = notify
+        self.processes = processes
+        self.tokens = None
+        self.done = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.done = True
+
+    def _run(self):
+        texts = self.texts
+        processes = self.processes or os.cpu_count() or 1
+        starts = chunk_starts(texts, processes)
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunks = {}  # start -> token lines, with those of the next line
+            while not self.done:
+                bounds = list(zip(starts, starts[1:] + [len(texts)]))
+                todo = [(a, b) for a, b in bounds if a not in chunks]
+                args = [(self.path, '\n'.join(texts[a:b+1])) for a, b in todo]
+                for (a, b), ltokens in zip(todo, pool.map(lex_chunk, args)):
+                    chunks[a] = ltokens
+                bad = [b for a, b in bounds[:-1] if chunks[a][b-a] != chunks[b][0]]
+                if len(bad) == 0:
+                    break
+                for b in bad:
+                    # join the chunk that ends at b with the next one
+                    starts.remove(b)
+                    chunks.pop(b, None)
+                    chunks.pop(starts[bisect.bisect_left(starts, b) - 1], None)
+            else:
+                return
+            self.tokens = self._merge(starts, chunks)
+        finally:
+            pool.terminate()
+            self.done = True
+            self.notify()
+
+    def _merge(self, starts, chunks):
+        types = {}
+        alltokens = []
+        bounds = zip(starts, starts[1:] + [len(self.texts)])
+        for a, b in bounds:
+            for ltokens in chunks[a][:b-a]:
+                line = []
+                for names, s in ltokens:
+                    tok = types.get(names)
+                    if tok is None:
+                        tok = Token
+                        for name in names:
+                            tok = getattr(tok, name)
+                        types[names] = tok
+                    line.append((tok, s))
+                alltokens.append(line)
+        return alltokens
+
+class DiffGutter(object):
+    """Marks the lines that differ from the last commit in a worker process.
+    The file on disk is diffed once, and from then on only the lines around
+    edits are sent over, from the nearest unchanged line above them to the one
+    below, along with the committed lines in between.
+    """
+
+    def __init__(self, name):
+        ctx = multiprocessing.get_context('fork')
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=diff_worker, args=(child, name),
+                                   daemon=True)
+        self.process.start()
+        child.close()
+        self.disk_marks = None  # mark of each line on disk, once diffed
+        self.head_of = None  # line on disk -> committed line, or -1
+        self.marks = {}  # widget -> (text version, mark) from diffing edits
+        self.dirty = set()  # edited and new lines
+        self.removed = set()  # lines that had lines deleted above them
+        self.pending = {}  # request key -> (widgets, text versions, line below)
+        self.key = 0
+
+    def close(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+    def forget(self, w):
+        self.marks.pop(w, None)
+        self.dirty.discard(w)
+        self.removed.discard(w)
+
+    def mark(self, w):
+        """Returns the gutter mark of a line."""
+        m = self.marks.get(w)
+        if m is not None and m[0] == w.text_version:
+            return m[1]
+        if w.disk_line is not None and w.is_unchanged():
+            if self.disk_marks is None or w.disk_line >= len(self.disk_marks):
+                return ' '
+            return self.disk_marks[w.disk_line]
+        # edited since the last diff
+        return '~' if w.original_text is not None else '+'
+
+    def head_line(self, w, dirty=()):
+        """Returns the committed line that w is the same as on disk, or None."""
+        d = w.disk_line
+        if d is None or d >= len(self.head_of) or w in dirty or not w.is_unchanged():
+            return None
+        h = self.head_of[d]
+        return h if h >= 0 else None
+
+    def update(self, walker, line_texts):
+        """Sends the ranges of lines around the edits to be diffed."""
+        dirty, self.dirty = self.dirty, set()
+        removed, self.removed = self.removed, set()
+        # lines that were read, or edited back, and have no stale mark are fine
+        dirty = {w for w in dirty if w in self.marks or self.head_line(w) is None}
+        dirty |= removed
+        lines = walker.lines
+        positions = sorted(p for p in map(walker.get_pos, dirty) if p is not None)
+        hi = 0
+        for p in positions:
+            if p < hi:
+                continue
+            lo = p
+            while lo > 0 and self.head_line(lines[lo - 1], dirty) is None:
+                lo -= 1
+            hi = p + 1
+            below, _ = walker._get_at_pos(hi)  # reads in lines as needed
+            while below is not None and self.head_line(below, dirty) is None:
+                hi += 1
+                below, _ = walker._get_at_pos(hi)
+            head_lo = 0 if lo == 0 else self.head_line(lines[lo - 1]) + 1
+            head_hi = None if below is None else self.head_line(below)
+            ws = lines[lo:hi]
+            self.key += 1
+            self.pending[self.key] = (ws, [w.text_version for w in ws], below,
+                                      None if below is None else below.text_version)
+            self.conn.send((self.key, line_texts(ws), head_lo, head_hi))
+
+    def receive(self):
+        """Takes in the diffs that have arrived. Returns the widgets whose
+        marks changed, or None once the whole file has been diffed. Raises
+        EOFError once the worker is gone.
+        """
+        changed = []
+        while self.conn.poll():
+            msg = self.conn.recv()
+            if msg[0] is None:
+                self.disk_marks, self.head_of = msg[1], msg[2]
+                changed = None
+                continue
+            ws, versions, below, bversion = self.pending.pop(msg[0])
+            marks, removed = msg[1], msg[2]
+            for w, v, m in zip(ws, versions, marks):
+                if w.text_version == v:
+                    self.marks[w] = (v, m)
+                    if changed is not None:
+                        changed.append(w)
+            if below is not None and below.text_version == bversion:
+                self.marks[below] = (bversion, '-' if removed else ' ')
+                if changed is not None:
+                    changed.append(below)
+        return changed
+
+_FOCUS_KEYS_ADDED = False
+
+def add_focus_keys():
+    """Teaches urwid the focus report sequences. This is done once per
+    process, since urwid refuses sequences that it already knows, and hosts
+    such as xonsh run the editor many times.
+    """
+    global _FOCUS_KEYS_ADDED
+    if _FOCUS_KEYS_ADDED:
+        return
+    for seq, key in FOCUS_KEYS:
+        urwid.escape.input_trie.add(urwid.escape.input_trie.data, seq, key)
+    _FOCUS_KEYS_ADDED = True
+
 class MainDisplay(object):
     base_palette = [('body', 'default', 'default'),
                     ('foot', 'black', 'dark blue', 'bold'),
-                    ('key', 'black', 'dark magenta', 'underline'),]
+                    ('key', 'black', 'dark magenta', 'underline'),
+                    ('match', 'black', 'dark cyan'),
+                    ('select', 'black', 'light gray'),
+                    ('fold', 'black', 'dark green'),
+                    ('diff add', 'dark green', 'default'),
+                    ('diff change', 'yellow', 'default'),
+                    ('diff remove', 'dark red', 'default'),]
 
     status_text = ('foot', ["xo    ", ('key', "^x"), " exit ",
                                       ('key', "^o"), " save ",
@@ -684,42 +2866,208 @@ class MainDisplay(object):
         self.load_rc()
         self.set_keybindings()
         self.jedi_imported_try = False
+        self.project_search = None
+        self.search_pipe = None
+        self.search = None
+        self.search_handles = None  # (watch, alarm) of the running search
+        self.highlight = None
+        self.highlight_pipe = None
+        self.highlight_key = None
+        self.highlight_version = None
+        self.highlight_alarm = None  # reads the rest of the file before lexing
+        self.stdin = None
+        self.loop = None
+        self.gutter = None
+        self.gutter_watch = None
+        self.gutter_alarm = None
+        self.pending_status = None
+        self.pastes = deque()  # text of bracketed pastes, one per 'paste' key
+        self.paste = None  # pieces of a paste that is still arriving
 
-    def init_file(self, name):
+    def init_file(self, name, follow=False, read_only=False, stdin=None):
         self.save_name = name
+        self.stdin = stdin
+        if compression_of(name) is not None or stdin is not None:
+            # streams can neither be memory mapped nor followed
+            follow = read_only = False
+        self.follow = follow and not read_only
+        self.read_only = read_only
+        self.session = load_session(name)
+        self.style = self.session.get('style', self.rc['style'])
+        self.large = self.is_large_file(name)
         self.set_tabs()
-        self.walker = LineWalker(name, main_display=self, tabsize=self.tabsize,
-                                 multiline_window=self.rc['multiline_window'])
+        self.set_comment()
+        # large files only get single line highlighting
+        nwindows = 0 if self.large else self.rc['number_of_windows']
+        if read_only:
+            self.walker = ViewWalker(name, main_display=self, tabsize=self.tabsize,
+                                     max_width=self.rc['long_line'])
+        else:
+            self.walker = LineWalker(name, main_display=self, tabsize=self.tabsize,
+                                     multiline_window=self.rc['multiline_window'],
+                                     number_of_windows=nwindows,
+                                     follow=follow, long_line=self.rc['long_line'],
+                                     long_line_chunk=self.rc['long_line_chunk'])
         self.listbox = urwid.ListBox(self.walker)
         self.status = urwid.AttrMap(urwid.Text(self.status_text), "foot")
         self.view = urwid.Frame(urwid.AttrMap(self.listbox, 'body'),
                                 footer=self.status)
         self.clipboard = None
-        self.queries = deque(self.rc["queries"], maxlen=self.rc["max_queries"])
-        self.replacements = deque(self.rc["replacements"],
-                                  maxlen=self.rc["max_replacements"])
+        # patterns are stored as strings and compiled when they are used
+        self.queries = History(os.path.join(CACHE_DIR, 'queries.log'),
+                               self.rc["max_queries"], self.rc["queries"])
+        self.replacements = History(os.path.join(CACHE_DIR, 'replacements.log'),
+                                    self.rc["max_replacements"],
+                                    self.rc["replacements"])
         self.name_complete_options = deque()
+        if read_only:
+            self.stop_gutter()
+            return
+        self.walker.journaling = self.rc['journal'] and not follow and stdin is None
+        self.walker.journal_interval = self.rc['journal_interval']
+        self.start_gutter()
+        if os.path.splitext(strip_compression(name))[1][1:] in self.rc['columnar']:
+            self.set_columns(True)
 
     def load_rc(self):
-        cacherc = json_rc_load('~/.cache/xo/rc.json')
-        configrc = json_rc_load(RC_PATH)
-        rc = merge_rcs(DEFAULT_RC, cacherc)
-        rc = merge_rcs(rc, configrc)
-        rc["queries"] = [re.compile(q) for q in rc["queries"]]
-        self.rc = rc
+        self.rc = load_rc()
+
+    def start_gutter(self):
+        """Diffs the file against its last commit in a worker process, for the
+        gutter. Any earlier diff is stopped.
+        """
+        self.stop_gutter()
+        walker = self.walker
+        name = self.save_name
+        # large files would be held in memory whole, twice, to be diffed
+        on = self.rc['diff_gutter'] and not (self.follow or self.large) \
+             and self.stdin is None and compression_of(name) is None \
+             and is_committed(name)
+        self.set_gutter_caption(' ' if on else '')
+        if not on:
+            return
+        self.gutter = walker.gutter = DiffGutter(name)
+        walker.gutter.dirty.update(w for w in walker.lines
+                                   if w.disk_line is None or not w.is_unchanged())
+        if self.loop is not None:
+            self.watch_gutter()
+
+    def set_gutter_caption(self, caption):
+        walker = self.walker
+        if walker.line_kwargs['caption'] != caption:
+            walker.line_kwargs['caption'] = caption
+            for w in walker.lines:
+                w.set_caption(caption)
+
+    def watch_gutter(self):
+        """Listens for diffs, and sends edits to be diffed on an alarm, while
+        there is a gutter.
+        """
+        loop = self.loop
+        self.gutter_watch = loop.watch_file(self.gutter.conn.fileno(),
+                                            self._gutter_message)
+        self.gutter_alarm = loop.set_alarm_in(self.rc['diff_gutter_interval'],
+                                              self.update_gutter)
+
+    def stop_gutter(self):
+        if self.gutter is None:
+            return
+        if self.gutter_watch is not None:
+            self.loop.remove_watch_file(self.gutter_watch)
+        if self.gutter_alarm is not None:
+            self.loop.remove_alarm(self.gutter_alarm)
+        self.gutter.close()
+        self.gutter = self.gutter_watch = self.gutter_alarm = None
+
+    def drop_gutter(self):
+        """Takes the gutter off the lines, after its worker died."""
+        self.stop_gutter()
+        self.walker.gutter = None
+        self.set_gutter_caption('')
+        for w in self.walker.lines:
+            w._invalidate()
+
+    def update_gutter(self, loop=None, user_data=None):
+        """Alarm callback that sends the lines edited since the last one to be
+        diffed against the last commit.
+        """
+        gutter = self.gutter
+        walker = self.walker
+        if gutter.disk_marks is not None and (gutter.dirty or gutter.removed):
+            try:
+                gutter.update(walker, self.line_texts)
+            except OSError:
+                self.drop_gutter()
+                return
+        self.gutter_alarm = self.loop.set_alarm_in(self.rc['diff_gutter_interval'],
+                                                   self.update_gutter)
+
+    def _gutter_message(self):
+        try:
+            changed = self.gutter.receive()
+        except (EOFError, OSError):
+            self.drop_gutter()
+            return
+        for w in self.walker.lines if changed is None else changed:
+            w._invalidate()
 
     def dump_cache(self):
-        cacherc = {"replacements": list(self.replacements),
-                   "queries": [q.pattern for q in self.queries]}
-        dname = os.path.expanduser('~/.cache/xo/')
-        if not os.path.isdir(dname):
-            os.makedirs(dname)
-        fname = os.path.join(dname, 'rc.json')
-        with open(fname, 'w') as f:
-            json.dump(cacherc, f)
+        """The histories are written as they are added to, so this only
+        migrates the histories of older versions out of the cache rc file.
+        """
+        fname = CACHE_RC_PATH
+        if os.path.isfile(fname):
+            self.queries.compact()
+            self.replacements.compact()
+            os.remove(fname)
+
+    def set_columns(self, on):
+        """Turns aligned columns on or off. The widths are estimated from a
+        sample of the file rather than from every row.
+        """
+        walker = self.walker
+        if on:
+            sep = ',' if strip_compression(self.save_name).endswith('.csv') else '\t'
+            widths = sample_column_widths(self.save_name, sep,
+                                          max_width=self.rc['column_max_width'])
+            walker.columns = (sep, widths)
+        else:
+            walker.columns = None
+        for w in walker.lines:
+            w._invalidate()
+        walker._modified()
+
+    def is_large_file(self, name):
+        """Whether a file should be opened in large file mode."""
+        large = self.rc['large_file']
+        if large is None and name == STDIN_NAME:
+            large = False  # its size is not known up front
+        elif large is None:
+            large = os.path.getsize(name) >= self.rc['large_file_size']
+        return large
+
+    def dump_session(self):
+        """Remembers the cursor, lexer and style for the next time this file is
+        opened.
+        """
+        if self.stdin is not None:
+            return
+        session = {'cursor': self.walker.get_coords(), 'style': self.style}
+        if self.walker.lexer is not None:
+            session['lexer'] = _lexer_class_path(self.walker.lexer)
+        dump_session(self.save_name, max_sessions=self.rc['max_sessions'], **session)
+
+    def set_comment(self):
+        name = os.path.basename(strip_compression(self.save_name))
+        for ext, prefix in self.rc["comments"].items():
+            if name.endswith('.' + ext) or name == ext:
+                self.comment = prefix
+                break
+        else:
+            self.comment = self.rc["comments"]["default"]
 
     def set_tabs(self):
-        name = self.save_name
+        name = strip_compression(self.save_name)
         for tab in sorted(self.rc["tabs"].items(), reverse=True):
             # reverse ensures longest match
             if name.endswith(tab[0]):
@@ -739,57 +3087,194 @@ class MainDisplay(object):
 
     def register_palette(self, style_class):
         """Converts pygmets style to urwid palatte"""
-        default = 'default'
-        palette = list(self.base_palette)
-        mapping = self.rc['rgb_to_short']
-        for tok in style_class.styles.keys():
-            for t in tok.split()[::-1]:
-                st = style_class.styles[t]
-                if '#' in st:
-                    break
-            if '#' not in st:
-                st = ''
-            st = st.split()
-            st.sort()   # '#' comes before '[A-Za-z0-9]'
-            if len(st) == 0:
-                c = default
-            elif st[0].startswith('bg:'):
-                c = default
-            elif len(st[0]) == 7:
-                c = 'h' + rgb_to_short(st[0][1:], mapping)[0]
-            elif len(st[0]) == 4:
-                c = 'h' + rgb_to_short(st[0][1]*2 + st[0][2]*2 + st[0][3]*2, mapping)[0]
-            else:
-                c = default
-            a = urwid.AttrSpec(c, default, colors=256)
-            row = (tok, default, default, default, a.foreground, default)
-            palette.append(row)
+        palette = style_palette(style_class, self.rc['rgb_to_short'],
+                                self.base_palette)
         self.loop.screen.register_palette(palette)
 
-    def main(self, line=1, col=1):
+    def main(self, line=None, col=None):
+        """Runs the editor. Without a line, it starts where the file was left."""
         loop = urwid.MainLoop(self.view,
             handle_mouse=False,
+            input_filter=self.filter_input,
             unhandled_input=self.unhandled_keypress)
         loop.screen.set_terminal_properties(256)
         self.loop = loop
-        self.register_palette(pygments_cache.get_style_by_name(self.rc["style"]))
+        self.register_palette(pygments_cache.get_style_by_name(self.style))
+        if line is None:
+            line, col = self.session.get('cursor', (1, 1))
+        status = self.recover()
         self.walker.goto(line, col)
         self.walker.all_tokens = None
-        while True:
-            try:
-                self.loop.run()
-            except KeyboardInterrupt:
-                self.reset_status(status="YOLO!   ")
-            else:
-                break
+        if self.follow:
+            loop.set_alarm_in(self.rc['follow_interval'], self.follow_file)
+        if self.walker.journaling:
+            loop.set_alarm_in(self.rc['journal_interval'], self.flush_journal)
+        if self.gutter is not None:
+            self.watch_gutter()
+        if self.rc['parallel_highlight'] and not (self.large or self.read_only):
+            self.highlight_version = self.walker.edit_version
+            loop.set_alarm_in(0, self.check_highlight)
+        if self.stdin is not None:
+            pipe = loop.watch_pipe(self.read_stdin)
+            self.stdin.notify = lambda: os.write(pipe, b'.')
+            self.stdin.start()
+        loop.event_loop.enter_idle(self.highlight_match)
+        loop.event_loop.enter_idle(self.update_status)
+        if status is not None:
+            self.reset_status(status=status)
+        paste = self.rc['bracketed_paste']
+        if paste:
+            loop.screen.write("\x1b[?2004h")
+        focus = self.rc['check_on_focus'] and not self.read_only
+        if focus:
+            add_focus_keys()
+            loop.screen.write("\x1b[?1004h")  # report focus in and out
+        try:
+            while True:
+                try:
+                    self.loop.run()
+                except KeyboardInterrupt:
+                    if self.cancel_search():
+                        self.reset_status(status="cancel  ")
+                    else:
+                        self.reset_status(status="YOLO!   ")
+                else:
+                    break
+        finally:
+            if paste:
+                loop.screen.write("\x1b[?2004l")
+            if focus:
+                loop.screen.write("\x1b[?1004l")
+            loop.screen.flush()
+
+    def filter_input(self, keys, raw):
+        """Turns each bracketed paste into a single 'paste' key, whose text is
+        queued in self.pastes. A paste may span several batches of input.
+        """
+        filtered = []
+        paste = self.paste
+        for k in keys:
+            if k == 'begin paste':
+                paste = []
+            elif paste is None:
+                filtered.append(k)
+            elif k == 'end paste':
+                self.pastes.append(''.join(paste))
+                filtered.append('paste')
+                paste = None
+            elif isinstance(k, str) and len(k) == 1:
+                paste.append(k)
+            elif k in PASTE_KEYS:
+                paste.append(PASTE_KEYS[k])
+        self.paste = paste
+        return filtered
+
+    def highlight_match(self):
+        """Idle callback that highlights matching brackets before a redraw."""
+        walker = self.walker
+        if self.read_only:
+            return
+        walker.highlight_match(limit=self.rc['match_scan_lines'])
+        walker.highlight_selection()
+
+    def recover(self):
+        """Replays the crash recovery journal for the file, if there is one."""
+        walker = self.walker
+        if not walker.journaling:
+            return
+        records = Journal.load(self.save_name, walker.tail_stat)
+        if not records:
+            return
+        walker.replay(records)
+        return "recovrd "
+
+    def flush_journal(self, loop=None, user_data=None):
+        """Alarm callback that hands the recently edited lines to the journal."""
+        self.walker.flush_journal()
+        self.loop.set_alarm_in(self.rc['journal_interval'], self.flush_journal)
+
+    def check_highlight(self, loop=None, user_data=None):
+        """Alarm callback that lexes the whole file in worker processes, once
+        its tokens are stale and it has gone a while without edits.
+        """
+        walker = self.walker
+        version = walker.edit_version
+        stale = walker.all_tokens is None or \
+                walker.highlighted != walker.token_generation
+        if self.highlight is None and self.highlight_alarm is None and stale \
+                and version == self.highlight_version and self.stdin is None:
+            self.highlight_file()
+        self.highlight_version = version
+        self.loop.set_alarm_in(self.rc['parallel_highlight_delay'],
+                               self.check_highlight)
+
+    def highlight_file(self, loop=None, user_data=None, batch=10000):
+        """Starts lexing the whole file with a process pool. The rest of a
+        lazily read file is read in first, a batch of lines per alarm, so that
+        keys are still handled meanwhile. Files that fit in a single window
+        are already lexed as a whole.
+        """
+        walker = self.walker
+        self.highlight_alarm = None
+        if walker.file is not None:
+            walker._ensure_read_in(len(walker.lines) + batch)
+            if walker.file is not None:
+                self.highlight_alarm = self.loop.set_alarm_in(0, self.highlight_file)
+                return
+        walker._ensure_lexer()
+        if len(walker.lines) <= walker.multiline_window:
+            return
+        if self.highlight_pipe is None:
+            self.highlight_pipe = self.loop.watch_pipe(self._highlight_done)
+        pipe = self.highlight_pipe
+        texts = [walker._etext(w) for w in walker.lines]
+        self.highlight_key = (walker.edit_version, walker.token_generation,
+                              len(walker.lines))
+        self.highlight = ParallelHighlight(walker.lexer, texts,
+                                           lambda: os.write(pipe, b'.'),
+                                           processes=self.rc['parallel_highlight_processes'])
+        self.highlight.start()
+
+    def _highlight_done(self, data):
+        job = self.highlight
+        if job is None or not job.done:
+            return True
+        self.highlight = None
+        walker = self.walker
+        key = (walker.edit_version, walker.token_generation, len(walker.lines))
+        if job.tokens is not None and key == self.highlight_key:
+            walker.set_all_tokens(job.tokens)
+        # otherwise the file was edited meanwhile, and is relexed when idle
+        return True
+
+    def read_stdin(self, data):
+        """Pipe callback that adds the text that has arrived on standard input."""
+        if self.stdin is None:
+            return False  # another file was opened, so stop watching the pipe
+        chunks = self.stdin.chunks
+        while chunks:
+            self.walker.extend(chunks.popleft())
+        return True
+
+    def follow_file(self, loop=None, user_data=None):
+        """Alarm callback that picks up new data in a followed file. If the
+        cursor is on the last line, it stays there, like tail -f.
+        """
+        walker = self.walker
+        at_end = walker.file is None and walker.focus + 1 >= len(walker.lines)
+        n = walker.poll_tail()
+        if at_end and (n > 0 or walker.file is not None):
+            walker.goto(sys.maxsize, 1)  # also catches the file being reopened
+        self.loop.set_alarm_in(self.rc['follow_interval'], self.follow_file)
 
     def seek_match(self):
         """Finds and jumps to the next match for the current query."""
         if len(self.queries) == 0:
-            stat = "no re   "
-        else:
-            stat = self.walker.seek_match(self.queries[-1])
-        return stat
+            return "no re   "
+        q = compile_query(self.queries[-1])
+        if q is not None:
+            return self.walker.seek_match(q)
+        return self.start_search(self.queries[-1])
 
     def replace_match(self):
         """Finds, jumps, and substitues to the next match for the current query &
@@ -799,16 +3284,139 @@ class MainDisplay(object):
             stat = "no re   "
         elif len(self.replacements) == 0:
             stat = "no sub  "
+        elif compile_query(self.queries[-1]) is not None:
+            stat = self.walker.replace_match(compile_query(self.queries[-1]),
+                                             self.replacements[-1])
         else:
-            stat = self.walker.replace_match(self.queries[-1], self.replacements[-1])
+            try:
+                q, r = re.compile(self.queries[-1]), self.replacements[-1]
+            except re.error:
+                return "bad re  "
+            stat = self.start_search(q.pattern,
+                                     then=lambda: self.walker.replace_here(q, r))
         return stat
 
+    def start_search(self, pattern, then=None):
+        """Searches for a regular expression in a worker process. The footer
+        shows its progress, and it is cancelled by ctrl c or once it runs out
+        of time.
+        """
+        self.cancel_search()
+        try:
+            target, args, total = self.walker.search_worker(pattern)
+        except re.error:
+            return "bad re  "
+        search = RegexSearch(target, args, then=then, total=total)
+        search.start()
+        watch = self.loop.watch_file(search.conn.fileno(), self._search_message)
+        alarm = self.loop.set_alarm_in(self.rc['search_timeout'], self._search_timeout)
+        self.search, self.search_handles = search, (watch, alarm)
+        return search.status
+
+    def cancel_search(self):
+        """Stops the running search, if any. Returns whether there was one."""
+        search = self.search
+        if search is None:
+            return False
+        watch, alarm = self.search_handles
+        self.loop.remove_watch_file(watch)
+        self.loop.remove_alarm(alarm)
+        search.cancel()
+        self.search = self.search_handles = None
+        return True
+
+    def _search_message(self):
+        search = self.search
+        msg = search.receive()
+        if msg is None:
+            self.reset_status(status=search.status)
+            return
+        self.cancel_search()
+        if msg[0] == 'error':
+            self.reset_status(status="srch err")
+            return
+        stat = self.walker.search_found(msg)
+        if stat is None and search.then is not None:
+            stat = search.then()
+        self.reset_status(status=stat or "xo      ")
+
+    def _search_timeout(self, loop=None, user_data=None):
+        if self.cancel_search():
+            self.reset_status(status="timeout ")
+
+    def search_project(self, q):
+        """Starts searching the files under the current directory for the
+        regular expression pattern q and shows the hits as a jump list.
+        """
+        try:
+            pattern = re.compile(q.encode(), re.MULTILINE)
+        except re.error:
+            return "bad re  "
+        if self.project_search is not None:
+            self.project_search.cancel()
+        if self.search_pipe is None:
+            self.search_pipe = self.loop.watch_pipe(self._project_hits_arrived)
+        pipe = self.search_pipe
+        notify = lambda: os.write(pipe, b'.')
+        search = ProjectSearch(os.getcwd(), pattern, notify,
+                               processes=self.rc['project_search_processes'],
+                               max_hits=self.rc['project_search_max_hits'])
+        self.project_search = search
+        self.jump_list = JumpListEditor(caption=self._jump_caption(), edit_text="",
+                                        deq=search.hits)
+        self.view.contents["footer"] = (urwid.AttrMap(self.jump_list, "foot"), None)
+        self.view.focus_position = "footer"
+        search.start()
+
+    def _jump_caption(self):
+        search = self.project_search
+        if search.error is not None:
+            state = "failed ({0})".format(search.error)
+        else:
+            state = "done" if search.done else "searching"
+        return "{0} hits, {1} (up, down keys): ".format(len(search.hits), state)
+
+    def _project_hits_arrived(self, data):
+        if self.view.contents["footer"][0].original_widget is self.jump_list:
+            self.jump_list.set_caption(self._jump_caption())
+        return True
+
+    def open_file(self, path, line=1, col=1):
+        """Jumps to a position in a file, switching files if the current one
+        has no unsaved changes.
+        """
+        if os.path.abspath(path) == os.path.abspath(self.save_name):
+            self.walker.goto(line, col)
+            return
+        elif self.walker.is_modified():
+            return "unsaved "
+        elif self.stdin is not None and not self.stdin.done:
+            return "reading "  # the rest of the pipe would be lost
+        self.walker.reset_journal()
+        self.dump_session()
+        self.init_file(path, read_only=self.read_only)
+        # a leftover journal is replayed, rather than appended to by new edits
+        status = self.recover()
+        self.loop.widget = self.view
+        self.walker.goto(line, col)
+        return status
+
     def load_file(self, fname):
         with open(fname) as f:
              rawlines = f.readlines()
         self.walker.insert_raw_lines(rawlines)
 
     def reset_status(self, status="xo      ", *args, **kwargs):
+        # the footer is only updated once per screen redraw, so keys that
+        # arrive together do not each pay for it
+        self.pending_status = status
+
+    def update_status(self):
+        """Idle callback that updates the footer before a redraw."""
+        status = self.pending_status
+        if status is None:
+            return
+        self.pending_status = None
         ncol, nrow = self.loop.screen.get_cols_rows()
         ft = self.status_text
         ft[1][0] = status
@@ -832,21 +3440,8 @@ class MainDisplay(object):
     def get_name_complete_options(self):
         """computes the best name completion and places into a dequeu"""
         # the code below came from save_file function
-        newlines = []
-        tabsize = self.tabsize
-        must_retab = self.must_retab
         walker = self.walker
-        for line in walker.lines:
-            # collect the text already stored in edit widgets
-            edit_text = line.edit_text
-            orig_text = line.original_text
-            if orig_text is None:
-                newline = retab(edit_text, tabsize) if must_retab else edit_text
-            elif sanitize_text(orig_text, tabsize) == edit_text:
-                newline = orig_text
-            else:
-                newline = retab(edit_text, tabsize) if must_retab else edit_text
-            newlines.append(ensure_endswith_newline(newline))
+        newlines = [ensure_endswith_newline(t) for t in self.line_texts(walker.lines)]
 
         while walker.file is not None:  # grab remaining lines
             newlines.append(ensure_endswith_newline(walker.read_next_line()))
@@ -875,12 +3470,42 @@ class MainDisplay(object):
         status = "xo      "
         fp = self.view.focus_position
         keybindings = self.keybindings
-        if k == keybindings["save"]:
-            self.save_file()
-            status = "saved   "
+        if k == "paste":
+            text = self.pastes.popleft()
+        if self.read_only and (k in [keybindings[c] for c in EDIT_COMMANDS] or
+                               k in EDIT_KEYS and fp == "body"):
+            self.reset_status(status="readonly")
+            return True
+        if k == keybindings["save"] and self.stdin is not None:
+            status = "no name "
+        elif k == keybindings["save"]:
+            status = "changed " if self.check_disk() else self.save()
+        elif k == "focus in":
+            if self.view.contents["footer"][0] is not self.status or not self.check_disk():
+                return True  # keeps the status
+            status = "changed "
+        elif k == "focus out":
+            return True
         elif k == keybindings["exit"]:
+            if self.project_search is not None:
+                self.project_search.cancel()
+            if self.highlight is not None:
+                self.highlight.cancel()
+            self.cancel_search()
+            self.stop_gutter()
+            self.walker.reset_journal()
+            self.dump_session()
             self.dump_cache()
             raise urwid.ExitMainLoop()
+        elif k == "paste":
+            if fp == "body":
+                self.walker.splice_text(text)
+            else:
+                # the footer only takes a single line, and text shown there
+                # (help, messages) does not take any, so the paste is dropped
+                w = self.view.focus.original_widget
+                if isinstance(w, urwid.Edit):
+                    w.insert_text(text.split('\n')[0])
         elif k == "delete" and fp == "body":
             # delete at end of line
             self.walker.combine_focus_with_next()
@@ -910,7 +3535,10 @@ class MainDisplay(object):
                 self.listbox.set_focus(pos, 'below')
                 self.loop.process_input(["end"])
         elif k == keybindings["cut"]:
-            self.walker.cut_to_clipboard()
+            if self.walker.mark is None:
+                self.walker.cut_to_clipboard()
+            else:
+                self.walker.cut_block()
             status = "cut     "
         elif k == keybindings["paste"]:
             self.walker.paste_from_clipboard()
@@ -922,9 +3550,7 @@ class MainDisplay(object):
             w, ypos = self.walker.get_focus()
             xpos = w.edit_pos
             re_word = RE_WORD if k == "ctrl left" else RE_NOT_WORD
-            starts = [m.start() for m in re_word.finditer(w.edit_text or "", 0, xpos)]
-            word_pos = xpos if len(starts) == 0 else starts[-1]
-            w.set_edit_pos(word_pos)
+            w.set_edit_pos(last_match_start(re_word, w.edit_text or "", xpos))
         elif k == "ctrl right" or k == "meta right":
             w, ypos = self.walker.get_focus()
             xpos = w.edit_pos
@@ -945,6 +3571,45 @@ class MainDisplay(object):
                     urwid.AttrMap(QueryEditor(caption="re: ", edit_text="",
                                   deq=self.queries), "foot"), None)
                 self.view.focus_position = "footer"
+        elif k == keybindings["find_project"]:
+            curr_footer = self.view.contents["footer"][0]
+            w = curr_footer.original_widget
+            if isinstance(w, QueryEditor):
+                status = w.run(self) or status
+                self.view.focus_position = "body"
+                self.view.contents["footer"] = (self.status, None)
+                curr_footer = self.status
+            if curr_footer is self.status:
+                if len(self.queries) == 0:
+                    status = "no re   "
+                else:
+                    status = self.search_project(self.queries[-1]) or status
+        elif k == keybindings["mark"]:
+            self.walker.toggle_mark()
+            status = "mark set" if self.walker.mark is not None else "unmarked"
+        elif k == keybindings["copy"]:
+            self.walker.copy_block()
+            status = "copied  "
+        elif k == keybindings["indent"]:
+            self.walker.indent_block(self.tabsize)
+        elif k == keybindings["dedent"]:
+            self.walker.dedent_block(self.tabsize)
+        elif k == keybindings["comment"]:
+            self.walker.comment_block(self.comment)
+        elif k == keybindings["fold"]:
+            if not self.walker.toggle_fold():
+                status = "no block"
+        elif k == keybindings["fold_all"]:
+            self.walker.toggle_fold_all()
+        elif k == keybindings["match"]:
+            match = self.walker.find_match()
+            if match is None:
+                status = "no match"
+            else:
+                self.walker.goto(match[0] + 1, match[1] + 1)
+        elif k == keybindings["columns"]:
+            self.set_columns(self.walker.columns is None)
+            status = "columns " if self.walker.columns else "raw     "
         elif k == keybindings["find_next"]:
             status = self.seek_match() or status
         elif k == keybindings["replace"]:
@@ -991,6 +3656,8 @@ class MainDisplay(object):
             else:
                 self.view.contents["footer"] = (self.status, None)
                 self.view.focus_position = "body"
+        elif k == keybindings["word_complete"] and fp == "body":
+            status = self.walker.complete_word()
         elif k == keybindings["name_complete"]:
                 if self.jedi_imported_try == False: # this code perfoms a lazy import
                     # lazy import is only done if it is needed the user pressed ctrl-n
@@ -1030,46 +3697,432 @@ class MainDisplay(object):
         self.reset_status(status=status)
         return True
 
+    def line_texts(self, lines):
+        """Returns the texts of line editors as they should be written out.
+        Unchanged lines keep their original text, and only the edited lines
+        are retabbed, all in one pass.
+        """
+        texts = []
+        dirty = []
+        for line in lines:
+            if line.is_unchanged():
+                texts.append(line.original_text)
+            else:
+                dirty.append(len(texts))
+                texts.append(line.edit_text)
+        if self.must_retab and len(dirty) > 0:
+            retabbed = retab_lines([texts[i] for i in dirty], self.tabsize)
+            for i, text in zip(dirty, retabbed):
+                texts[i] = text
+        return texts
+
     def save_file(self):
-        """Write the file out to disk."""
-        newlines = []
-        tabsize = self.tabsize
-        must_retab = self.must_retab
+        """Write the file out to disk. Returns the texts that the lines were
+        written as.
+        """
+        if self.large:
+            return self.stream_save_file()
         walker = self.walker
-        for line in walker.lines:
-            # collect the text already stored in edit widgets
-            edit_text = line.edit_text
-            orig_text = line.original_text
-            if orig_text is None:
-                newline = retab(edit_text, tabsize) if must_retab else edit_text
-            elif sanitize_text(orig_text, tabsize) == edit_text:
-                newline = orig_text
-            else:
-                newline = retab(edit_text, tabsize) if must_retab else edit_text
-            newlines.append(ensure_endswith_newline(newline))
+        # collect the text already stored in edit widgets
+        newlines = [ensure_endswith_newline(t) for t in self.line_texts(walker.lines)]
 
         while walker.file is not None:  # grab remaining lines
             newlines.append(ensure_endswith_newline(walker.read_next_line()))
-        newlines = [line.rstrip() + '\n' for line in newlines]
+        texts = [line.rstrip() for line in newlines]
+        newlines = [text + '\n' for text in texts]
 
         last_line = newlines[-1]
         newlines[-1] = last_line[:-1] if last_line.endswith('\n') else last_line
-        with open(self.save_name, "w") as f:
+        with open_text(self.save_name, "w") as f:
             for newline in newlines:
                 f.write(newline)
+        return texts
+
+    def save(self):
+        """Saves the file and takes note of it as the version on disk. The
+        lines become unchanged, with what they were written as for their
+        original text, and the unread lines follow them.
+        """
+        walker = self.walker
+        texts = self.save_file()
+        walker.reset_journal()
+        walker.tail_stat = os.stat(self.save_name)
+        if walker.stamp is not None:
+            walker.stamp = FileStamp(self.save_name)
+        for i, (w, text) in enumerate(zip(walker.lines, texts)):
+            w.original_text = text
+            w.expanded_text = w.edit_text
+            w.disk_line = i
+        walker.nread = len(walker.lines)
+        if self.gutter is not None:
+            self.start_gutter()
+        return "saved   "
+
+    def check_disk(self):
+        """Asks whether to reload, merge, or overwrite the file when it changed
+        on disk since it was read. Returns whether it did.
+        """
+        stamp = self.walker.stamp
+        if stamp is None:
+            return False
+        offset = stamp.changed()
+        if offset is None:
+            return False
+        self.disk_offset = offset
+        self.view.contents["footer"] = (urwid.AttrMap(ChangedFileEditor(
+            caption="file changed on disk, (r)eload, (m)erge, or (o)verwrite: ",
+            edit_text=""), "foot"), None)
+        self.view.focus_position = "footer"
+        return True
+
+    def reload_file(self):
+        """Drops the edits and reads the parts of the file that changed."""
+        walker = self.walker
+        walker.reload(self.disk_offset)
+        walker.reset_journal()
+        if self.gutter is not None:
+            self.start_gutter()
+        return "reloaded"
+
+    def merge_file(self):
+        """Keeps the edits on top of the file as it is now on disk."""
+        conflicts = self.walker.merge()
+        if self.gutter is not None:
+            self.start_gutter()
+        return "conflict" if conflicts else "merged  "
+
+    def stream_save_file(self):
+        """Write the file out to disk a line at a time. Lines that have not been
+        read in yet are copied over as they are, without being read in, unless
+        the file cannot seek back to where reading stopped, as zstd streams
+        cannot, when the rest is read in first. Returns the texts that the
+        lines were written as.
+        """
+        walker = self.walker
+        if walker.file is not None and not walker.file.seekable():
+            walker._ensure_read_in(sys.maxsize)
+        rest = walker.file
+        last = len(walker.lines) - 1
+        tmp = self.save_name + '.xo-save'
+        texts = [t.rstrip() for t in self.line_texts(walker.lines)]
+        with open_text(tmp, "w", compression_of(self.save_name)) as f:
+            for i, newline in enumerate(texts):
+                f.write(newline if i == last and rest is None else newline + '\n')
+            if rest is not None:
+                pos = rest.tell()
+                shutil.copyfileobj(rest, f)
+                rest.seek(pos)
+        if os.path.exists(self.save_name):
+            shutil.copymode(self.save_name, tmp)
+        # the walker still reads from the replaced file, which has the same tail
+        os.replace(tmp, self.save_name)
+        return texts
 
 ensure_endswith_newline = lambda x: x if x.endswith('\n') else x + '\n'
 
-def retab(s, tabsize):
-    # via http://code.activestate.com/recipes/65226-expanding-and-compressing-tabs/
-    pieces = RE_SPACES.split(s)
-    for i, piece in enumerate(pieces):
-        thislen = len(piece)
-        if piece.isspace():
-            numtabs = thislen // tabsize
-            numblanks = thislen % tabsize
-            pieces[i] = '\t' * numtabs + ' ' * numblanks
-    return ''.join(pieces)
+def last_match_start(regex, s, pos, step=256):
+    """Returns the start of the last match of regex in s[:pos], or pos if there
+    is no match. This only looks as far back from pos as it needs to.
+    """
+    lo = pos
+    while lo > 0:
+        lo = max(lo - step, 0)
+        starts = [m.start() for m in regex.finditer(s, lo, pos)]
+        # a match at lo may really have started further back
+        if len(starts) > 0 and (starts[-1] > lo or lo == 0):
+            return starts[-1]
+        step *= 2
+    return pos
+
+def project_files(root):
+    """Yields the files under root relative to it. In a git repository the
+    ignored files are skipped.
+    """
+    try:
+        out = subprocess.check_output(['git', 'ls-files', '-z', '--cached',
+                                       '--others', '--exclude-standard'],
+                                      cwd=root, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        out = None
+    if out is not None:
+        for f in out.split(b'\0'):
+            if f:
+                yield os.fsdecode(f)
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for f in filenames:
+            yield os.path.relpath(os.path.join(dirpath, f), root)
+
+def search_lines(conn, pattern, texts, line, col, name=None, cookie=None,
+                 tabsize=4):
+    """Searches texts for the compiled pattern after (line, col), then the rest
+    of the file from cookie on, and then from the top. This runs in a worker
+    process and sends ('progress', lines searched) now and then, and finally
+    ('found', line, col) or ('none',), down conn.
+    """
+    q = pattern
+    def candidates():
+        for i in range(line, len(texts)):
+            yield i, texts[i]
+        if name is not None:
+            with open_text(name) as f:
+                f.seek(cookie)
+                for i, text in enumerate(f, len(texts)):
+                    yield i, sanitize_text(text, tabsize)
+        for i in range(0, line + 1):
+            yield i, texts[i]
+    last = time.monotonic()
+    for n, (i, text) in enumerate(candidates()):
+        m = q.search(text, col + 1 if n == 0 else 0)
+        if m is not None:
+            conn.send(('found', i, m.start()))
+            return
+        now = time.monotonic()
+        if now - last > 0.1:
+            conn.send(('progress', n))
+            last = now
+    conn.send(('none',))
+
+def search_child(target, conn, *args):
+    """Runs a search in a forked worker process. An error is sent down conn
+    as ('error', message), rather than printed over the editor.
+    """
+    try:
+        target(conn, *args)
+    except KeyboardInterrupt:
+        pass  # the editor cancels the search on ctrl c
+    except Exception as e:
+        try:
+            conn.send(('error', str(e)))
+        except OSError:
+            pass  # the search was cancelled
+
+def search_mmap(conn, pattern, mm, start):
+    """Searches a memory map for a compiled bytes pattern from start on, and
+    then from the top. This runs in a worker process and sends the offset found.
+    """
+    m = pattern.search(mm, start) or pattern.search(mm, 0, start)
+    conn.send(('none',) if m is None else ('found', m.start()))
+
+def git_head_text(name):
+    """Returns the text of a file as of the last commit, read from the git
+    object store, or None if it is not committed.
+    """
+    dirname, basename = os.path.split(os.path.abspath(name))
+    try:
+        blob = subprocess.check_output(['git', 'cat-file', 'blob', 'HEAD:./' + basename],
+                                       cwd=dirname, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return io.TextIOWrapper(io.BytesIO(blob), errors='replace').read()
+
+def is_committed(name):
+    """Whether there is a version of the file in the last git commit."""
+    dirname, basename = os.path.split(os.path.abspath(name))
+    try:
+        subprocess.check_call(['git', 'cat-file', '-e', 'HEAD:./' + basename],
+                              cwd=dirname, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return True
+
+def diff_marks(a, b, head_of=None):
+    """Returns the gutter marks of the lines b against the lines a, and
+    whether lines of a were removed after the last one. Lines of b that match
+    one in a are recorded in head_of, if given.
+    """
+    marks = [' '] * len(b)
+    removed = False
+    for op, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b).get_opcodes():
+        if op == 'equal':
+            if head_of is not None:
+                head_of[j1:j2] = array('q', range(i1, i2))
+        elif op == 'insert':
+            marks[j1:j2] = '+' * (j2 - j1)
+        elif op == 'replace':
+            marks[j1:j2] = '~' * (j2 - j1)
+        elif j1 < len(b):
+            marks[j1] = '-'
+        else:
+            removed = True
+    return ''.join(marks), removed
+
+def diff_worker(conn, name):
+    """Diffs a file against its last commit and sends the marks of its lines,
+    then diffs the ranges of edited lines that it is sent. It exits quietly
+    when the editor goes away or something fails, which the editor sees as
+    the end of the pipe.
+    """
+    try:
+        head = (git_head_text(name) or '').split('\n')
+        with open_text(name) as f:
+            disk = f.read().split('\n')
+        head_of = array('q', [-1]) * len(disk)
+        marks, removed = diff_marks(head, disk, head_of)
+        if removed and marks[-1:] == ' ':
+            marks = marks[:-1] + '-'
+        conn.send((None, marks, head_of))
+        while True:
+            key, texts, lo, hi = conn.recv()
+            conn.send((key,) + diff_marks(head[lo:hi], texts))
+    except Exception:
+        pass  # a traceback would be printed over the editor
+    finally:
+        conn.close()
+
+def token_lines(tokens):
+    """Splits a stream of tokens into a list of tokens for each line."""
+    ltokens = []
+    alltokens = []
+    for token, s in tokens:
+        if len(s) == 0:
+            continue
+        if '\n' not in s:
+            ltokens.append((token, s))
+            continue
+        spl = s.split('\n')
+        ltokens.append((token, spl[0]))
+        for text in spl[1:]:
+            alltokens.append(ltokens)
+            ltokens = [(token, text)]
+    return alltokens
+
+def lex_chunk(args):
+    """Lexes text in a worker process and returns the tokens of each line.
+    Token types are sent back as tuples of names, which pickle small.
+    """
+    path, text = args
+    lexer = pooled_lexer(*path)
+    # the lexer strips blank lines from both ends, which are put back here so
+    # that the lines of the chunk still line up with those of the file
+    lead = len(text) - len(text.lstrip('\n'))
+    alltokens = [[] for i in range(lead)]
+    alltokens.extend([(tuple(tok), s) for tok, s in ltokens]
+                     for ltokens in token_lines(lexer.get_tokens(text)))
+    alltokens.extend([] for i in range(text.count('\n') + 1 - len(alltokens)))
+    return alltokens
+
+def chunk_starts(texts, nchunks, min_lines=2000):
+    """Returns the indices of the lines that start the chunks that texts is
+    lexed in. Chunks start on an unindented line after a blank one, which is
+    where lexers are most likely to be back in their root state.
+    """
+    size = max(len(texts) // max(nchunks, 1), min_lines)
+    starts = [0]
+    i = size
+    while i < len(texts):
+        t = texts[i]
+        if t[:1].strip() and t[:1] not in ')]}' and not texts[i-1].strip():
+            starts.append(i)
+            i += size
+        else:
+            i += 1
+    return starts
+
+def search_file(args, max_hits=100, max_width=200):
+    """Finds the matches of a compiled bytes regular expression in a file,
+    which is memory mapped rather than read. Binary files are skipped. This
+    runs in a worker process and returns (path, line, col, text) tuples.
+    """
+    path, pattern = args
+    hits = []
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return hits
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return hits
+    with mm:
+        if mm.find(b'\0', 0, 8192) >= 0:
+            return hits  # binary
+        line, last = 1, 0
+        for m in pattern.finditer(mm):
+            start = m.start()
+            line += mm[last:start].count(b'\n')
+            last = start
+            bol = mm.rfind(b'\n', 0, start) + 1
+            eol = mm.find(b'\n', start)
+            eol = len(mm) if eol < 0 else eol
+            text = mm[bol:min(eol, bol + max_width)].decode('utf-8', 'replace')
+            col = len(mm[bol:start].decode('utf-8', 'replace')) + 1
+            hits.append((path, line, col, text.strip()))
+            if len(hits) >= max_hits:
+                break
+    return hits
+
+def retab_lines(lines, tabsize):
+    """Retabs many lines at once, with a single regex pass over all of them."""
+    tabbed = {}
+    def repl(m):
+        n = len(m.group(0))
+        t = tabbed.get(n)
+        if t is None:
+            tabbed[n] = t = '\t' * (n // tabsize) + ' ' * (n % tabsize)
+        return t
+    return RE_SPACES.sub(repl, '\n'.join(lines)).split('\n')
+
+def highlight_columns(attrib, cols, attr):
+    """Returns a copy of the run length encoded attributes of a line, where the
+    characters at the given columns have another attribute.
+    """
+    attrib = list(attrib)
+    for col in cols:
+        start = 0
+        for i, (a, n) in enumerate(attrib):
+            if start <= col < start + n:
+                runs = [(a, col - start), (attr, 1), (a, start + n - col - 1)]
+                attrib[i:i+1] = [run for run in runs if run[1] > 0]
+                break
+            start += n
+    return attrib
+
+def split_cells(text, sep):
+    """Splits a row of delimited data into its cells."""
+    if sep == ',':
+        return next(csv.reader([text]), [])
+    return text.split(sep)
+
+def sample_column_widths(fname, sep, nlines=1000, nseeks=8, max_width=40):
+    """Estimates the column widths of a delimited file from the lines at the
+    top, and from lines at a few evenly spaced offsets into the file. Only the
+    top of a compressed file is sampled, as seeking would inflate all of it.
+    """
+    widths = []
+    size = os.path.getsize(fname)
+    if compression_of(fname) is None:
+        f = open(fname, errors='replace')
+    else:
+        f = open_text(fname)
+        nseeks = 0
+    with f:
+        for i in range(nseeks + 1):
+            n = nlines
+            if i > 0:
+                n //= nseeks
+                f.seek(size * i // (nseeks + 1))
+                f.readline()  # skip the partial line
+            for _, line in zip(range(n), f):
+                cells = split_cells(line.rstrip('\n'), sep)
+                for j, cell in enumerate(cells):
+                    w = min(len(cell), max_width)
+                    if j == len(widths):
+                        widths.append(w)
+                    elif w > widths[j]:
+                        widths[j] = w
+    return widths
+
+def detach_stdin():
+    """Moves the pipe on standard input out of the way, so that keys can be read
+    from the terminal. Returns the pipe. Raises OSError when there is no
+    controlling terminal.
+    """
+    tty = os.open('/dev/tty', os.O_RDONLY)
+    pipe = os.fdopen(os.dup(0), 'rb', buffering=0)
+    os.dup2(tty, 0)
+    os.close(tty)
+    return pipe
 
 def touch(filename):
     """Opens a file and updates the mtime, like the posix command of the same name."""
@@ -1087,7 +4140,8 @@ def main(args=None):
     parser = ArgumentParser(prog='xo', formatter_class=RawDescriptionHelpFormatter,
                             description=__doc__.format(**main_display.keybindings))
     path = parser.add_argument('path', help=("path to file, may include colon separated "
-                                             "line and col numbers, eg 'path/to/xo.py:10:42'"))
+                                             "line and col numbers, eg 'path/to/xo.py:10:42', "
+                                             "or - to read standard input"))
 
     class EitherOrAction(_StoreTrueAction):
         def __call__(self, parser, namespace, values, option_string=None):
@@ -1098,6 +4152,10 @@ def main(args=None):
                         help="display run control file")
     parser.add_argument('--rc-edit', action=EitherOrAction,
                         help="open run control file")
+    parser.add_argument('-f', '--follow', action='store_true', default=False,
+                        help="follow the file as it grows, like tail -f")
+    parser.add_argument('--view', action='store_true', default=False,
+                        help="view the file read-only, like a pager")
     parser.add_argument('-v', '--version', action=EitherOrAction,
                         help="show version and exit")
 
@@ -1110,12 +4168,33 @@ def main(args=None):
             print(f.read())
         return
     ns.path = RC_PATH if ns.rc_edit else ns.path
+    if ns.path == STDIN_NAME:
+        if sys.stdin.isatty():
+            sys.exit("Error: nothing is piped to standard input")
+        try:
+            pipe = detach_stdin()
+        except OSError as e:
+            sys.exit("Error: no terminal to read keys from: {0}".format(e))
+        main_display.init_file(STDIN_NAME, stdin=StdinReader(pipe))
+        main_display.main(1, 1)
+        return
     path, line, col = path_line_col(ns.path)
-    if not os.path.exists(path):
+    compression = compression_of(path)
+    if compression is not None:
+        try:
+            importlib.import_module(compression)
+        except ImportError:
+            sys.exit("Error: {0} is needed to open {1!r}".format(compression, path))
+    if ns.view and not os.path.isfile(path):
+        sys.exit("Error: may not view {0!r}".format(path))
+    elif not os.path.exists(path):
         touch(path)
     elif os.path.isdir(path):
         sys.exit("Error: may not open directory {0!r}".format(path))
-    main_display.init_file(path)
+    if path == ns.path.rstrip(':'):
+        # no position given, so follow from the end or resume where we left off
+        line, col = (sys.maxsize, 1) if ns.follow else (None, None)
+    main_display.init_file(path, follow=ns.follow, read_only=ns.view)
     main_display.main(line, col)
 
 if __name__=="__main__":
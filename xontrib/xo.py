@@ -1,6 +1,7 @@
 """Exofrills xontrib."""
+from threading import Thread
 from xonsh.proc import unthreadable, uncapturable
-from xo import main as _main
+from xo import main as _main, warm as _warm
 
 @unthreadable
 @uncapturable
@@ -8,5 +9,8 @@ def _xo(args, stdin=None):
     _main(args=args)
 
 
+# the rc, palette, and lexers are kept warm in this process, so build them
+# while the shell is idle rather than on the first xo
+Thread(target=_warm, daemon=True).start()
 aliases['xo'] = _xo
-del unthreadable, uncapturable
+del Thread, unthreadable, uncapturable